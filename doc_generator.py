@@ -5,22 +5,2179 @@ Converts a directory tree of Markdown files into a single Word document,
 rendering Mermaid diagrams as images and applying custom Word styling.
 """
 
+import base64
+import errno
+import fnmatch
 import os
 import re
+import signal
 import subprocess
 import shutil
 import sys
+import threading
 import hashlib
+import http.client
+import http.server
+import io
+import json
+import socket
+import sqlite3
+import tarfile
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple, Set
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Set
 import argparse
+from abc import ABC, abstractmethod
+
+
+# Passing an argument list with shell=True only works on Windows; on POSIX the
+# shell would receive just the program name and drop every argument.
+USE_SHELL = os.name == "nt"
+
+# Each mmdc process starts its own headless Chromium. Adaptive concurrency
+# may go up to one render per CPU, since it backs off when memory runs short;
+# without a free-memory reading (Windows, macOS) or with --fixed-jobs nothing
+# would hold it back, so the default stays modest there.
+DEFAULT_JOBS = os.cpu_count() or 1
+MODEST_JOBS = min(4, DEFAULT_JOBS)
+
+# Adaptive render concurrency: assumed memory per render until one has been
+# observed, memory kept free for the rest of the host, and how often the
+# host is sampled while renders run
+DEFAULT_RENDER_MEMORY = 300 * 1024 ** 2
+MEMORY_RESERVE = 512 * 1024 ** 2
+CONCURRENCY_SAMPLE_INTERVAL = 0.25
+
+# Render settings passed to every renderer (mmdc flags or daemon options)
+DEFAULT_RENDER_OPTIONS = {
+    "theme": "default",
+    "backgroundColor": "white",
+    "scale": 2,           # 2x resolution for crisp images
+    "width": 1200,        # Wider viewport for better diagram layout
+    "height": 800,        # Taller viewport for complex diagrams
+}
+
+
+# Directories never searched for Markdown files
+DEFAULT_EXCLUDED_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".tox"}
+
+# Exclude patterns read from this file in the root directory, one per line
+DOCIGNORE_FILE = ".docignore"
+
+# Layout version of the build manifest kept in the output directory
+BUILD_MANIFEST_VERSION = 1
+
+# Bump when the same source file is turned into different processed Markdown
+# (e.g. diagram blocks are found differently), so memoized files are redone
+MARKDOWN_PROCESSING_VERSION = 3
+
+# Source files are copied into the combined Markdown in chunks of this many characters
+CONCAT_CHUNK_SIZE = 1024 * 1024
+
+# Fenced code block languages rendered as diagrams, and the diagram language each one is
+DIAGRAM_FENCES = {
+    "mermaid": "mermaid",
+    "dot": "graphviz",
+    "graphviz": "graphviz",
+    "plantuml": "plantuml",
+    "puml": "plantuml",
+}
+
+# PlantUML's URL-safe base64 variant used to encode diagrams into server URLs
+PLANTUML_BASE64 = str.maketrans(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/",
+    "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-_"
+)
+
+# Mermaid rendering backends; "auto" picks the fastest one available
+RENDERERS = ("auto", "browser", "kroki", "mmdc")
+DEFAULT_KROKI_URL = "http://localhost:8000"
+
+# Longest a build waits for another build that is rendering the same diagram
+LOCK_TIMEOUT = 900
+
+# Longest a single diagram render may take before its renderer is killed
+DEFAULT_RENDER_TIMEOUT = 120
+
+# How often a batch render is checked for newly written images (seconds)
+RENDER_PROGRESS_INTERVAL = 1.0
+
+# Extra attempts for renders that failed for reasons unrelated to the diagram,
+# waiting RENDER_RETRY_BACKOFF, then twice that, ... seconds in between
+DEFAULT_RENDER_RETRIES = 2
+RENDER_RETRY_BACKOFF = 2.0
+
+# Renderer errors worth retrying: browser crashes and hangs rather than
+# mistakes in the diagram source, which fail the same way every time
+TRANSIENT_RENDER_ERRORS = re.compile(
+    r"timed? ?out|Target closed|Protocol error|Session closed|crashed|ECONNRESET|ECONNREFUSED|"
+    r"Failed to launch the browser|socket hang up|Navigation failed",
+    re.IGNORECASE
+)
+
+# A line mmdc's Markdown reader could take for the start or end of a block;
+# diagrams containing one would cut the batch file short or split it
+BATCH_UNSAFE_LINE = re.compile(r'^[^\S\n]*(?:`{3}|:{3})|(?:`{3}|:{3})[^\S\n]*$', re.MULTILINE)
+
+# Page geometry of Pandoc's built-in reference.docx (Letter, 1in margins),
+# used when no template is given: usable width and height in inches
+DEFAULT_PAGE_GEOMETRY = {"width": 6.5, "height": 9.0}
+
+# Diagrams are laid out in CSS pixels; 96 of them make an inch
+CSS_PIXELS_PER_INCH = 96
+
+# Target print resolution of diagrams fitted to the page (2x CSS pixels)
+DEFAULT_DIAGRAM_DPI = 192
+
+# png: raster images only; svg: vector images with a small PNG fallback for
+# Word versions without SVG support; both: vector images with a full-size PNG
+DIAGRAM_FORMATS = ("png", "svg", "both")
+
+# Mermaid config used for SVG output; Word ignores HTML labels in foreignObject
+SVG_MERMAID_CONFIG = {"htmlLabels": False, "flowchart": {"htmlLabels": False}}
+
+# DrawingML extension that carries the SVG version of a picture
+SVG_BLIP_EXTENSION_URI = "{96DAC541-7B7A-43D3-8B79-37D633B846F1}"
+
+# Bump when the cache key layout changes so old entries are never misread
+CACHE_KEY_VERSION = 1
+
+
+# Diagram type declarations the pre-render check accepts as the first statement
+MERMAID_DIAGRAM_TYPES = (
+    "graph", "flowchart", "flowchart-elk", "sequenceDiagram", "classDiagram", "classDiagram-v2",
+    "stateDiagram", "stateDiagram-v2", "erDiagram", "journey", "gantt", "pie", "quadrantChart",
+    "requirementDiagram", "gitGraph", "C4Context", "C4Container", "C4Component", "C4Dynamic",
+    "C4Deployment", "mindmap", "timeline", "zenuml", "sankey-beta", "xychart-beta", "block-beta",
+    "packet-beta", "kanban", "architecture-beta", "radar-beta", "treemap-beta", "packet", "sankey",
+    "xychart", "block", "architecture", "radar", "treemap", "info",
+)
+FLOWCHART_DIRECTIONS = ("TB", "TD", "BT", "RL", "LR")
+
+# Statements that open a block closed by ``end``, per diagram type
+MERMAID_END_BLOCKS = {
+    "graph": ("subgraph",),
+    "flowchart": ("subgraph",),
+    "sequenceDiagram": ("loop", "alt", "opt", "par", "critical", "break", "rect", "box"),
+}
+
+
+# Remote cache requests give up after this many seconds (the build then carries on without it)
+REMOTE_CACHE_TIMEOUT = 10
+
+# Layout version of the archives written by ``cache export``
+CACHE_BUNDLE_VERSION = 1
+
+
+# Diagram cache eviction policy defaults
+DEFAULT_CACHE_MAX_BYTES = 1024 ** 3           # 1 GiB
+DEFAULT_CACHE_MAX_AGE = 30 * 24 * 3600        # 30 days
+DEFAULT_CACHE_KEEP_BUILDS = 10
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte size such as ``500M`` or ``2G`` (binary units)."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', text, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid size: {text}")
+    exponent = " KMGT".index(match.group(2).upper() or " ")
+    return int(float(match.group(1)) * 1024 ** exponent)
+
+
+def format_size(size: int) -> str:
+    """Human-readable byte size."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def default_cache_dir() -> Path:
+    """Per-user diagram cache shared by all builds (XDG cache directory on POSIX)."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or str(Path.home() / "AppData" / "Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "doc-generator" / "diagrams"
+
+
+def reflink_file(source: Path, destination: Path) -> bool:
+    """Copy-on-write clone of ``source`` (Linux FICLONE); False where unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    FICLONE = 0x40049409
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if destination.exists():
+            destination.unlink()
+        return False
+
+
+class RenderError(Exception):
+    """A renderer could not produce a diagram.
+
+    ``transient`` failures (timeouts, browser crashes, overloaded servers)
+    may succeed when tried again; the others lie in the diagram itself.
+    """
+    
+    def __init__(self, message: str, transient: bool = False):
+        super().__init__(message)
+        self.transient = transient
+
+
+class RenderTimeout(RenderError):
+    """A renderer was killed, or given up on, for exceeding its time limit."""
+    
+    def __init__(self, message: str):
+        super().__init__(message, transient=True)
+
+
+class MissingCacheFiles(Exception):
+    """Indexed diagrams whose files were gone when the build came to use them.
+
+    Their index rows have already been dropped, so processing the sources
+    again renders them anew.
+    """
+    
+    def __init__(self, keys: Set[str]):
+        super().__init__(f"{len(keys)} cached diagram(s) missing from the cache directory")
+        self.keys = keys
+
+
+def run_renderer(command: List[str], timeout: Optional[float],
+                 progress: Optional[Callable[[], int]] = None) -> subprocess.CompletedProcess:
+    """Run a renderer in its own process group, killing the whole group on timeout.
+
+    mmdc starts a headless Chromium with several helper processes; killing
+    only the Node process would leave those behind. Raises RenderTimeout
+    when the time limit is hit and CalledProcessError on a non-zero exit.
+    With ``progress``, a function counting the outputs written so far, the
+    limit applies to the time since the count last grew instead of the
+    whole run.
+    """
+    if USE_SHELL and not shutil.which(command[0]):
+        # Through cmd.exe a missing program is just a failed command, which
+        # would be mistaken for an error in the diagram and recorded as such
+        raise FileNotFoundError(errno.ENOENT, f"{command[0]} not found on PATH", command[0])
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               shell=USE_SHELL, **process_group_options())
+    deadline = time.monotonic() + timeout if timeout else None
+    done = progress() if progress else 0
+    timed_out = False
+    try:
+        while True:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if progress and wait is not None:
+                wait = min(wait, RENDER_PROGRESS_INTERVAL)
+            try:
+                stdout, stderr = process.communicate(timeout=wait)
+                break
+            except subprocess.TimeoutExpired:
+                if progress and progress() > done:
+                    done = progress()
+                    deadline = time.monotonic() + timeout
+                elif time.monotonic() >= deadline:
+                    timed_out = True
+                    break
+    except BaseException:
+        kill_process_group(process)
+        process.communicate()
+        raise
+    if timed_out:
+        kill_process_group(process)
+        process.communicate()
+        stalled = f" without progress after {done} output(s)" if progress else ""
+        raise RenderTimeout(f"Renderer timed out after {timeout:g}s{stalled}; killed process group {process.pid}")
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def process_group_options() -> Dict[str, Any]:
+    """Popen arguments that start a process in a new process group."""
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def kill_process_group(process: subprocess.Popen) -> None:
+    """Kill a process started by ``run_renderer`` together with all its children."""
+    try:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)], capture_output=True)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError):
+        process.kill()
+
+
+def is_transient_render_error(error: BaseException) -> bool:
+    """Whether a failed render may succeed when simply tried again."""
+    if isinstance(error, RenderError):
+        return error.transient
+    if isinstance(error, subprocess.CalledProcessError):
+        # Killed by a signal (negative return code), e.g. the OOM killer
+        return error.returncode < 0 or bool(TRANSIENT_RENDER_ERRORS.search(error.stderr or ""))
+    return False
+
+
+def place_file(source: Path, destination: Path) -> str:
+    """Make ``source`` available at ``destination`` as cheaply as possible.
+
+    Tries a hard link, then a reflink, and copies only as a last resort.
+    The file is created under a temporary name and renamed into place, so
+    readers never see a partial file. Returns the method that was used.
+    """
+    temporary = temporary_path(destination)
+    try:
+        try:
+            os.link(source, temporary)
+            method = "hard link"
+        except OSError:
+            if reflink_file(source, temporary):
+                method = "reflink"
+            else:
+                shutil.copy2(source, temporary)
+                method = "copy"
+        os.replace(temporary, destination)
+        return method
+    finally:
+        if temporary.exists():
+            temporary.unlink()
+
+
+def temporary_path(destination: Path) -> Path:
+    """Unique hidden sibling of ``destination`` with the same suffix (tools pick formats by suffix)."""
+    fd, name = tempfile.mkstemp(prefix=f".{destination.stem}-", suffix=destination.suffix, dir=destination.parent)
+    os.close(fd)
+    os.unlink(name)
+    return Path(name)
+
+
+def atomic_write(destination: Path, data: bytes) -> None:
+    """Write ``data`` to a temporary file and rename it over ``destination``."""
+    temporary = temporary_path(destination)
+    try:
+        temporary.write_bytes(data)
+        os.replace(temporary, destination)
+    finally:
+        if temporary.exists():
+            temporary.unlink()
+
+
+class FileLock:
+    """Advisory inter-process lock on a lock file.
+
+    Uses ``flock`` on POSIX. Windows has no shared locks, so shared
+    acquisitions are exclusive there and concurrent builds serialize.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.handle = None
+    
+    def acquire(self, shared: bool = False, timeout: Optional[float] = None) -> bool:
+        """Take the lock; ``timeout`` None waits forever, 0 tries once. Returns False on timeout."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.path, "a+b")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                if os.name == "nt":
+                    import msvcrt
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(handle, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+                self.handle = handle
+                return True
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    handle.close()
+                    return False
+                time.sleep(0.05)
+    
+    def release(self) -> None:
+        if self.handle is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.handle, fcntl.LOCK_UN)
+        finally:
+            self.handle.close()
+            self.handle = None
+
+
+# External lossless PNG optimizers, best first; each rewrites the file in place
+PNG_OPTIMIZERS = [
+    ["oxipng", "--opt", "2", "--strip", "safe", "--quiet"],
+    ["optipng", "-quiet", "-o2"],
+]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Images with more bytes than this in Average or Paeth filtered rows skip the
+# built-in palette reduction, which decodes those rows byte by byte
+PNG_SLOW_FILTER_LIMIT = 4 * 1024 ** 2
+
+# Ancillary chunks that affect how the image is displayed; everything else
+# (text, timestamps) is dropped by the pure-Python optimizer
+PNG_KEEP_CHUNKS = {b"PLTE", b"tRNS", b"gAMA", b"cHRM", b"sRGB", b"iCCP", b"pHYs"}
+
+
+def read_page_geometry(docx_path: Path) -> Dict[str, float]:
+    """Usable page width and height in inches from the last section of a .docx.
+
+    Reads ``w:pgSz`` and ``w:pgMar`` (in twentieths of a point) of the final
+    ``w:sectPr``, which holds the document-wide page settings.
+    """
+    with zipfile.ZipFile(docx_path) as docx:
+        document = docx.read("word/document.xml").decode('utf-8')
+    sections = re.findall(r'<w:sectPr\b.*?</w:sectPr>', document, re.DOTALL)
+    if not sections:
+        raise ValueError(f"No section properties in {docx_path}")
+    
+    def attributes(element: str) -> Dict[str, int]:
+        match = re.search(rf'<w:{element}\b([^>]*)/>', sections[-1])
+        if not match:
+            raise ValueError(f"No w:{element} in the section properties of {docx_path}")
+        return {name: int(value) for name, value in re.findall(r'w:(\w+)="(-?\d+)"', match.group(1))}
+    
+    size, margins = attributes("pgSz"), attributes("pgMar")
+    twips_per_inch = 1440
+    return {
+        "width": (size["w"] - margins.get("left", 0) - margins.get("right", 0) - margins.get("gutter", 0))
+                 / twips_per_inch,
+        "height": (size["h"] - abs(margins.get("top", 0)) - abs(margins.get("bottom", 0))) / twips_per_inch,
+    }
+
+
+def image_css_width(path: Path) -> Optional[float]:
+    """Width of a rendered diagram in CSS pixels at scale 1, read from the file header.
+
+    PNG widths are in device pixels and must still be divided by the render
+    scale. SVG widths come from an absolute ``width`` (Graphviz uses points)
+    or else from the ``viewBox``.
+    """
+    if path.suffix == ".png":
+        with open(path, "rb") as image:
+            header = image.read(24)
+        if header.startswith(PNG_SIGNATURE) and header[12:16] == b"IHDR":
+            return float(int.from_bytes(header[16:20], "big"))
+        return None
+    with open(path, "rb") as image:
+        head = image.read(4096).decode('utf-8', 'replace')
+    root = re.search(r'<svg\b[^>]*>', head)
+    if not root:
+        return None
+    width = re.search(r'\swidth="([\d.]+)(px|pt)?"', root.group(0))
+    if width:
+        return float(width.group(1)) * (CSS_PIXELS_PER_INCH / 72 if width.group(2) == "pt" else 1)
+    match = re.search(r'viewBox="\s*[-\d.]+[\s,]+[-\d.]+[\s,]+([\d.]+)', root.group(0))
+    return float(match.group(1)) if match else None
+
+
+def plantuml_encode(text: str) -> str:
+    """Encode a PlantUML diagram for a server URL: raw deflate, then PlantUML's base64 variant."""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    data = compressor.compress(text.encode('utf-8')) + compressor.flush()
+    # PlantUML encodes whole 3-byte groups; the zero padding is ignored by inflate
+    data += b"\0" * (-len(data) % 3)
+    return base64.b64encode(data).decode('ascii').translate(PLANTUML_BASE64)
+
+
+def plantuml_command() -> Optional[List[str]]:
+    """Command starting PlantUML: ``java -jar $PLANTUML_JAR`` or a ``plantuml`` launcher on PATH."""
+    jar = os.environ.get("PLANTUML_JAR")
+    if jar:
+        return ["java", "-Djava.awt.headless=true", "-jar", jar]
+    if shutil.which("plantuml"):
+        return ["plantuml"]
+    return None
+
+
+def tool_version(cache_dir: Path, command: List[str], binary: Optional[str] = None) -> str:
+    """First line of a tool's version output, cached per binary (path and mtime) to skip a process start per build."""
+    binary = binary or shutil.which(command[0]) or command[0]
+    try:
+        mtime = os.stat(binary).st_mtime
+    except OSError:
+        mtime = None
+    
+    version_file = cache_dir / ".renderer-version.json"
+    try:
+        known = json.loads(version_file.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        known = {}
+    if not isinstance(known, dict) or "version" in known:
+        # Single-tool layout written by older versions
+        known = {}
+    cached = known.get(binary)
+    if isinstance(cached, dict) and cached.get("mtime") == mtime and "version" in cached:
+        return cached["version"]
+    
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, shell=USE_SHELL, timeout=60)
+        # Graphviz prints its version to stderr
+        output = (result.stdout.strip() or result.stderr.strip()).splitlines()
+        version = output[0].strip() if output and result.returncode == 0 else "unknown"
+    except (OSError, subprocess.SubprocessError):
+        version = "unknown"
+    
+    if version != "unknown":
+        known[binary] = {"mtime": mtime, "version": version}
+        atomic_write(version_file, json.dumps(known).encode('utf-8'))
+    return version
+
+
+# CommonMark code fence: a run of at least three backticks or tildes and an info string
+FENCE_PATTERN = re.compile(r'( *)(`{3,}|~{3,})(.*)')
+# Start of a list item; the match ends where the item's content starts
+LIST_ITEM_PATTERN = re.compile(r'( *)([-+*]|\d{1,9}[.)])( +|$)')
+
+
+def strip_block_quotes(line: str, depth: int) -> Optional[str]:
+    """``line`` without its first ``depth`` block quote markers (``>``), or None when it has fewer."""
+    match = re.match(rf'(?: {{0,3}}> ?){{{depth}}}', line)
+    return line[match.end():] if match else None
+
+
+def tokenize_fences(lines: Iterable[str]) -> Iterator[Tuple[Any, ...]]:
+    """Split Markdown lines into plain text and diagram code blocks in one linear pass.
+
+    Yields ``("text", number, line)`` for every line outside a diagram
+    block and ``("diagram", (start, end, code, language), code_line, indent)``
+    for every diagram fence (see ``DIAGRAM_FENCES``): ``start`` is the
+    index of the opening fence line, ``end`` the index just past the
+    closing one, ``code_line`` the index of its first line of code and
+    ``indent`` what precedes the fence on its line (spaces, block quote
+    markers and a list marker), for the replacement to stay in the same
+    container. Fences
+    follow CommonMark: backtick or tilde runs of three or more, closed by a
+    run of the same character at least as long, with CRLF line endings
+    allowed. Anything inside another fence is text, so diagram examples
+    inside a ````markdown block stay as they are. A fence indented by four
+    or more spaces only counts inside a list item it is indented into;
+    elsewhere it is an indented code block. Fences inside block quotes
+    (``> ```mermaid``) end with the quote. An unclosed diagram fence is
+    left as text.
+    """
+    fence: Optional[Tuple[str, int, int, int]] = None
+    diagram: Optional[Tuple[int, str, str]] = None
+    buffered: List[str] = []
+    code_lines: List[str] = []
+    # Content columns of the list items the current line may belong to
+    list_indents: List[int] = []
+    previous_blank = True
+    
+    for number, line in enumerate(lines):
+        content = line.rstrip("\r\n")
+        if fence is not None:
+            char, length, indent, depth = fence
+            body = strip_block_quotes(content, depth)
+            if body is None:
+                # The block quote holding the fence ended, and the fence with it
+                if diagram is not None:
+                    for offset, text in enumerate(buffered):
+                        yield ("text", diagram[0] + offset, text)
+                    diagram = None
+                fence = None
+        
+        if fence is None:
+            quote = re.match(r'(?: {0,3}> ?)*', content).group()
+            body = content[len(quote):]
+            stripped = body.lstrip(" ")
+            column = len(body) - len(stripped)
+            item = None
+            if not stripped:
+                previous_blank = True
+            else:
+                item = LIST_ITEM_PATTERN.match(body)
+                if item or previous_blank:
+                    # A new item, or a paragraph after a blank line, ends the items it is not indented into
+                    while list_indents and list_indents[-1] > column:
+                        list_indents.pop()
+                if item:
+                    list_indents.append(item.end())
+                previous_blank = False
+            
+            match = FENCE_PATTERN.fullmatch(body)
+            marker = ""
+            if item and not match:
+                # The fence may start on the list marker's line (- ```mermaid);
+                # its content is then indented to the item's content column
+                marker = body[:item.end()]
+                match = FENCE_PATTERN.fullmatch(body[item.end():])
+            # A backtick fence's info string may not contain backticks
+            if (match and not (match.group(2)[0] == "`" and "`" in match.group(3))
+                    and (column < 4 or any(item_column <= column <= item_column + 3 for item_column in list_indents))):
+                fence = (match.group(2)[0], len(match.group(2)), len(marker) + len(match.group(1)), quote.count(">"))
+                info = match.group(3).split()
+                if info and info[0] in DIAGRAM_FENCES:
+                    diagram = (number, DIAGRAM_FENCES[info[0]], quote + marker + match.group(1))
+                    buffered = [line]
+                    code_lines = []
+                    continue
+            yield ("text", number, line)
+            continue
+        
+        stripped = body.lstrip(" ")
+        closing = (len(body) - len(stripped) < indent + 4
+                   and len(stripped.rstrip(" \t")) >= length
+                   and stripped.rstrip(" \t") == char * len(stripped.rstrip(" \t")))
+        if diagram is None:
+            yield ("text", number, line)
+        elif not closing:
+            buffered.append(line)
+            # Content lines lose up to the fence's own indentation
+            code_lines.append(re.sub(rf'^ {{0,{indent}}}', "", body))
+            continue
+        else:
+            start, language, prefix = diagram
+            code = "\n".join(code_lines).strip()
+            if code:
+                blank = next(n for n, code in enumerate(code_lines) if code.strip())
+                yield ("diagram", (start, number + 1, code, language), start + 1 + blank, prefix)
+            else:
+                # Nothing to render: leave the empty block alone
+                for offset, text in enumerate(buffered + [line]):
+                    yield ("text", start + offset, text)
+            diagram = None
+        if closing:
+            fence = None
+            previous_blank = False
+    
+    if diagram is not None:
+        for offset, text in enumerate(buffered):
+            yield ("text", diagram[0] + offset, text)
+
+
+def unbalanced_flowchart_brackets(statement: str) -> Optional[str]:
+    """Problem with the brackets or quotes of one flowchart statement, or None.
+
+    Only the node shape delimiters are matched: quoted strings, ``|edge
+    labels|`` and the text inside a shape may contain anything but the
+    shape's closing bracket, as in Mermaid itself. Shapes open with a run
+    of brackets (``[[``, ``([``, ``(((``...) closed in reverse order, or
+    with ``id>`` for the asymmetric shape.
+    """
+    closing = {"(": ")", "[": "]", "{": "}"}
+    i = 0
+    while i < len(statement):
+        char = statement[i]
+        if char in "\"|":
+            end = statement.find(char, i + 1)
+            if end < 0:
+                return "Unterminated quote" if char == '"' else "Unterminated edge label '|'"
+            i = end + 1
+        elif char in closing or (char == ">" and i and (statement[i - 1].isalnum() or statement[i - 1] == "_")):
+            start = i
+            i += 1
+            while char != ">" and i < len(statement) and i - start < 3 and statement[i] in closing:
+                i += 1
+            opener = statement[start:i]
+            closer = "]" if opener == ">" else "".join(closing[bracket] for bracket in reversed(opener))
+            # Skip the label text up to the first closing bracket, outside quotes
+            while i < len(statement) and statement[i] != closer[0]:
+                if statement[i] == '"':
+                    end = statement.find('"', i + 1)
+                    if end < 0:
+                        return "Unterminated quote"
+                    i = end
+                i += 1
+            if i == len(statement):
+                if opener == ">":
+                    # Not a shape after all, e.g. text on an old-style edge: A -- a>b --> B
+                    i = start + 1
+                    continue
+                return f"Unclosed '{opener}'"
+            if not statement.startswith(closer, i):
+                return f"Unbalanced '{statement[i]}' (expected '{closer}' to close '{opener}')"
+            i += len(closer)
+        elif char in ")]}":
+            return f"Unbalanced '{char}'"
+        else:
+            i += 1
+    return None
+
+
+def check_mermaid_syntax(code: str) -> List[Tuple[int, str, bool]]:
+    """Cheap structural check of one Mermaid diagram, returning (line in block, message, certain) per problem.
+
+    Catches the mistakes that most often break a render: a missing or
+    unknown diagram type, an invalid flowchart direction, unbalanced
+    brackets or quotes in flowchart statements and ``end`` blocks that are
+    never closed or never opened. Only an empty diagram and an unknown
+    diagram type are ``certain``; the rest is no substitute for the Mermaid
+    parser and may be wrong about diagrams Mermaid accepts.
+    """
+    statements = []
+    in_front_matter = False
+    for n, line in enumerate(code.split("\n"), start=1):
+        stripped = line.strip()
+        if stripped == "---" and (n == 1 or in_front_matter):
+            in_front_matter = not in_front_matter
+        elif stripped and not in_front_matter and not stripped.startswith("%%"):
+            statements.append((n, stripped))
+    if not statements:
+        return [(1, "Empty diagram: no diagram type declared", True)]
+    
+    header_line, header = statements[0]
+    words = header.rstrip(";").split()
+    diagram_type = words[0]
+    # Mermaid detects the type by prefix (``gitGraph:``, ``graph TD;``), so only
+    # a header starting with none of the known types is certainly wrong
+    if not header.startswith(MERMAID_DIAGRAM_TYPES):
+        return [(header_line, f"Unknown diagram type '{diagram_type}'", True)]
+    
+    errors = []
+    flowchart = diagram_type in ("graph", "flowchart", "flowchart-elk")
+    if flowchart and len(words) > 1 and words[1] not in FLOWCHART_DIRECTIONS:
+        errors.append((header_line, f"Invalid flowchart direction '{words[1]}' "
+                                    f"(expected one of {', '.join(FLOWCHART_DIRECTIONS)})", False))
+    
+    openers = MERMAID_END_BLOCKS.get("flowchart" if flowchart else diagram_type, ())
+    open_blocks: List[Tuple[int, str]] = []
+    for n, statement in statements[1:]:
+        keyword = statement.split()[0].rstrip(";")
+        if keyword in openers:
+            open_blocks.append((n, keyword))
+        elif keyword == "end" and openers:
+            if open_blocks:
+                open_blocks.pop()
+            else:
+                errors.append((n, "'end' without an open block", False))
+        
+        if flowchart:
+            problem = unbalanced_flowchart_brackets(statement)
+            if problem:
+                errors.append((n, problem, False))
+    
+    for n, keyword in open_blocks:
+        errors.append((n, f"'{keyword}' block is never closed with 'end'", False))
+    return sorted(errors)
+
+
+def find_png_optimizer() -> Optional[List[str]]:
+    """Command prefix of the best installed PNG optimizer, or None to use the pure-Python one."""
+    for command in PNG_OPTIMIZERS:
+        if shutil.which(command[0]):
+            return command
+    return None
+
+
+def read_png_chunks(data: bytes) -> List[Tuple[bytes, bytes]]:
+    """Split PNG data into (type, payload) chunks."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    chunks = []
+    offset = len(PNG_SIGNATURE)
+    while offset < len(data):
+        length = int.from_bytes(data[offset:offset + 4], "big")
+        chunk_type = data[offset + 4:offset + 8]
+        chunks.append((chunk_type, data[offset + 8:offset + 8 + length]))
+        offset += 12 + length
+        if chunk_type == b"IEND":
+            break
+    return chunks
+
+
+def write_png_chunks(chunks: List[Tuple[bytes, bytes]]) -> bytes:
+    output = [PNG_SIGNATURE]
+    for chunk_type, payload in chunks:
+        output.append(len(payload).to_bytes(4, "big") + chunk_type + payload
+                      + zlib.crc32(chunk_type + payload).to_bytes(4, "big"))
+    return b"".join(output)
+
+
+def unfilter_png_rows(raw: bytes, width: int, height: int, bpp: int) -> List[bytes]:
+    """Undo the per-row PNG filters of an 8-bit, non-interlaced image.
+
+    None, Sub and Up rows are decoded a whole row at a time: the row is
+    packed into one integer and bytes are added without carries between
+    them (SWAR), Sub as a prefix sum in log2(width) steps. Only Average
+    and Paeth, where every byte depends on the one just decoded, need a
+    byte loop.
+    """
+    stride = width * bpp
+    high_bits = int.from_bytes(b"\x80" * stride, "big")
+    low_bits = int.from_bytes(b"\x7f" * stride, "big")
+    
+    def add_bytes(x: int, y: int) -> int:
+        return ((x & low_bits) + (y & low_bits)) ^ ((x ^ y) & high_bits)
+    
+    previous = bytes(stride)
+    rows = []
+    for y in range(height):
+        start = y * (stride + 1)
+        filter_type = raw[start]
+        line = raw[start + 1:start + 1 + stride]
+        if filter_type == 0:  # None
+            row = bytes(line)
+        elif filter_type == 1:  # Sub: running sum of each channel
+            decoded = int.from_bytes(line, "big")
+            shift = bpp
+            while shift < stride:
+                decoded = add_bytes(decoded, decoded >> (8 * shift))
+                shift *= 2
+            row = decoded.to_bytes(stride, "big")
+        elif filter_type == 2:  # Up
+            row = add_bytes(int.from_bytes(line, "big"), int.from_bytes(previous, "big")).to_bytes(stride, "big")
+        elif filter_type == 3:  # Average
+            decoded = bytearray(line)
+            for i in range(stride):
+                left = decoded[i - bpp] if i >= bpp else 0
+                decoded[i] = (decoded[i] + ((left + previous[i]) >> 1)) & 0xFF
+            row = bytes(decoded)
+        else:  # Paeth
+            decoded = bytearray(line)
+            for i in range(bpp):
+                decoded[i] = (decoded[i] + previous[i]) & 0xFF
+            for i in range(bpp, stride):
+                a, b, c = decoded[i - bpp], previous[i], previous[i - bpp]
+                pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                decoded[i] = (decoded[i] + (a if pa <= pb and pa <= pc else (b if pb <= pc else c))) & 0xFF
+            row = bytes(decoded)
+        rows.append(row)
+        previous = row
+    return rows
+
+
+def slow_png_filter_bytes(raw: bytes, width: int, height: int, bpp: int) -> int:
+    """Bytes in Average and Paeth rows, the ones ``unfilter_png_rows`` decodes byte by byte."""
+    stride = width * bpp
+    return sum(stride for y in range(height) if raw[y * (stride + 1)] >= 3)
+
+
+def optimize_png_data(data: bytes) -> bytes:
+    """Losslessly shrink PNG data without external tools.
+
+    Drops text and timestamp chunks, converts 8-bit truecolor images with
+    at most 256 distinct colours to a palette (with tRNS for transparency)
+    and recompresses at the highest zlib level. Returns the smaller of the
+    original and the optimized data.
+    """
+    chunks = read_png_chunks(data)
+    if not chunks or chunks[0][0] != b"IHDR":
+        raise ValueError("PNG file does not start with an IHDR chunk")
+    header = chunks[0][1]
+    width, height = int.from_bytes(header[0:4], "big"), int.from_bytes(header[4:8], "big")
+    bit_depth, color_type, interlace = header[8], header[9], header[12]
+    idat = b"".join(payload for chunk_type, payload in chunks if chunk_type == b"IDAT")
+    kept = [(chunk_type, payload) for chunk_type, payload in chunks
+            if (chunk_type != b"IDAT" and chunk_type[0:1].isupper()) or chunk_type in PNG_KEEP_CHUNKS]
+    
+    def assemble(ihdr: bytes, extra: List[Tuple[bytes, bytes]], pixels: bytes) -> bytes:
+        ancillary = [chunk for chunk in kept if chunk[0] not in (b"IHDR", b"IEND", b"PLTE", b"tRNS")]
+        return write_png_chunks([(b"IHDR", ihdr)] + extra + ancillary
+                                + [(b"IDAT", zlib.compress(pixels, 9)), (b"IEND", b"")])
+    
+    raw = zlib.decompress(idat)
+    palette_extra = [chunk for chunk in kept if chunk[0] in (b"PLTE", b"tRNS")]
+    candidates = [assemble(header, palette_extra, raw)]
+    
+    # Palette reduction for 8-bit RGB/RGBA images with few colours, unless
+    # decoding would take seconds in pure Python
+    bpp = 3 if color_type == 2 else 4
+    if (bit_depth == 8 and color_type in (2, 6) and interlace == 0
+            and slow_png_filter_bytes(raw, width, height, bpp) <= PNG_SLOW_FILTER_LIMIT):
+        # Pixels as 32-bit integers (RGB padded with a zero byte), so each row
+        # is converted to palette indexes by one C-level map
+        colors: Dict[int, int] = {}
+        indexed_rows: Dict[bytes, bytes] = {}
+        indexed = []
+        padded = bytearray(width * 4)
+        for row in unfilter_png_rows(raw, width, height, bpp):
+            # Diagrams repeat rows a lot (margins, straight edges)
+            if row not in indexed_rows:
+                for channel in range(bpp):
+                    padded[channel::4] = row[channel::bpp]
+                pixels = array("I", padded)
+                new = set(pixels).difference(colors)
+                if len(colors) + len(new) > 256:
+                    break
+                for pixel in sorted(new):
+                    colors[pixel] = len(colors)
+                indexed_rows[row] = b"\x00" + bytes(map(colors.__getitem__, pixels))
+            indexed.append(indexed_rows[row])
+        
+        if len(indexed) == height:
+            palette = [pixel.to_bytes(4, sys.byteorder) for pixel in sorted(colors, key=colors.get)]
+            extra = [(b"PLTE", b"".join(pixel[:3] for pixel in palette))]
+            alphas = b""
+            if bpp == 4:
+                alphas = bytes(pixel[3] for pixel in palette)
+            elif any(chunk_type == b"tRNS" for chunk_type, _ in kept):
+                # The RGB colour key (16-bit samples) becomes a transparent palette entry
+                key = next(payload for chunk_type, payload in kept if chunk_type == b"tRNS")
+                key = bytes([key[1], key[3], key[5], 0])
+                alphas = bytes(0 if pixel == key else 255 for pixel in palette)
+            # Entries past the last transparent one default to opaque
+            alphas = alphas.rstrip(b"\xff")
+            if alphas:
+                extra.append((b"tRNS", alphas))
+            ihdr = header[:8] + bytes([8, 3]) + header[10:]
+            candidates.append(assemble(ihdr, extra, b"".join(indexed)))
+    
+    return min(candidates + [data], key=len)
+
+
+def optimize_png_file(path: str, command: Optional[List[str]] = None) -> Tuple[int, int]:
+    """Optimize a PNG in place (atomically); returns (bytes before, bytes after).
+
+    Module-level so the pure-Python optimizer can run in worker processes.
+    """
+    path = Path(path)
+    original = path.read_bytes()
+    if command:
+        temporary = temporary_path(path)
+        try:
+            temporary.write_bytes(original)
+            subprocess.run(command + [str(temporary)], capture_output=True, shell=USE_SHELL, check=True)
+            optimized = temporary.read_bytes()
+        finally:
+            if temporary.exists():
+                temporary.unlink()
+    else:
+        optimized = optimize_png_data(original)
+    
+    if len(optimized) < len(original):
+        atomic_write(path, optimized)
+        return len(original), len(optimized)
+    return len(original), len(original)
+
+
+def default_daemon_socket() -> Path:
+    """Per-user socket path of the render daemon."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "doc-generator-render.sock"
+    user = os.environ.get("USER") or os.environ.get("USERNAME") or "user"
+    return Path(tempfile.gettempdir()) / f"doc-generator-render-{user}.sock"
+
+
+def send_message(sock: socket.socket, header: Dict[str, Any], body: bytes = b"") -> None:
+    """Send one daemon protocol message: a JSON header line followed by ``size`` body bytes."""
+    header = dict(header, size=len(body))
+    sock.sendall(json.dumps(header).encode('utf-8') + b"\n" + body)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], bytes]:
+    """Receive one daemon protocol message sent by ``send_message``."""
+    stream = sock.makefile("rb")
+    try:
+        line = stream.readline()
+        if not line:
+            raise ConnectionError("Render daemon closed the connection")
+        header = json.loads(line)
+        body = stream.read(header.get("size", 0))
+        return header, body
+    finally:
+        stream.close()
+
+
+class RenderDaemonClient:
+    """Talks to a running ``RenderDaemon`` over its Unix socket."""
+    
+    def __init__(self, socket_path: Path, timeout: float = 120):
+        self.socket_path = Path(socket_path)
+        self.timeout = timeout
+    
+    def request(self, header: Dict[str, Any], body: bytes = b"") -> Tuple[Dict[str, Any], bytes]:
+        """Send one request and wait for its response (one connection per request)."""
+        if not hasattr(socket, "AF_UNIX"):
+            raise ConnectionError("Unix sockets are not supported on this platform")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(str(self.socket_path))
+            send_message(sock, header, body)
+            return recv_message(sock)
+    
+    def stats(self) -> Optional[Dict[str, Any]]:
+        """Return daemon health/stats, or None when no daemon is listening."""
+        if not self.socket_path.exists():
+            return None
+        try:
+            header, _ = self.request({"op": "stats"})
+        except (OSError, ValueError):
+            return None
+        return header if header.get("ok") else None
+    
+    def render(self, code: str, output_format: str, options: Dict[str, Any]) -> bytes:
+        """Render one diagram; raises RuntimeError with the renderer's message on failure."""
+        header, body = self.request(
+            {"op": "render", "format": output_format, "options": options},
+            code.encode('utf-8')
+        )
+        if not header.get("ok"):
+            raise RuntimeError(header.get("error", "Render daemon failed"))
+        return body
+    
+    def validate(self, codes: List[str]) -> List[Optional[str]]:
+        """Parse diagrams without rendering them: the parser error of each, or None."""
+        header, body = self.request({"op": "validate"}, json.dumps(codes).encode('utf-8'))
+        if not header.get("ok"):
+            raise ValueError(header.get("error", "Render daemon failed"))
+        return json.loads(body)
+
+
+class DiagramRenderer(ABC):
+    """Interface shared by the diagram rendering backends.
+
+    ``render`` writes one diagram as ``output_format`` ("png" or "svg") to
+    ``destination``. It raises RenderError when the diagram cannot be
+    rendered and OSError when the backend itself cannot be reached, in which
+    case the build falls back to the Mermaid CLI.
+    """
+    
+    name = "renderer"
+    # Whether PNG output honours the ``scale`` render option
+    applies_scale = True
+    
+    @abstractmethod
+    def available(self) -> bool:
+        """Whether the backend can render right now."""
+    
+    @abstractmethod
+    def version(self) -> str:
+        """Identifies the renderer's output in the cache key."""
+    
+    @abstractmethod
+    def render(self, code: str, output_format: str, options: Dict[str, Any], destination: Path) -> None:
+        """Write one diagram to ``destination``."""
+    
+    def validate(self, codes: List[str]) -> Optional[List[Optional[str]]]:
+        """Parser error of each diagram (None when it parses), or None without a parser of its own."""
+        return None
+    
+    def describe(self) -> str:
+        return self.name
+    
+    def close(self) -> None:
+        """Release anything kept running between renders."""
+
+
+class MmdcRenderer(DiagramRenderer):
+    """The Mermaid CLI, which starts Node and a headless Chromium for every call."""
+    
+    name = "mmdc"
+    
+    def __init__(self, cache_dir: Path, timeout: Optional[float] = None):
+        self.cache_dir = Path(cache_dir)
+        self.timeout = timeout
+        self._version: Optional[str] = None
+    
+    def available(self) -> bool:
+        return shutil.which("mmdc") is not None or self.version() != "unknown"
+    
+    def version(self) -> str:
+        """Return the Mermaid CLI version, cached per mmdc binary to avoid a Node startup per build."""
+        if self._version is None:
+            self._version = tool_version(self.cache_dir, ["mmdc", "--version"])
+        return self._version
+    
+    def options(self, render_options: Dict[str, Any], svg: bool = False) -> List[str]:
+        """Command line flags for the given render options."""
+        options = []
+        for name, value in render_options.items():
+            options.extend([f"--{name}", str(value)])
+        if svg:
+            options.extend(["--configFile", str(self.svg_config_file())])
+        return options
+    
+    def svg_config_file(self) -> Path:
+        """Mermaid config for SVG output: plain SVG text labels instead of HTML
+        ``foreignObject`` labels, which Word cannot display."""
+        config_file = self.cache_dir / ".mermaid-svg-config.json"
+        if not config_file.exists():
+            atomic_write(config_file, json.dumps(SVG_MERMAID_CONFIG).encode('utf-8'))
+        return config_file
+    
+    def render(self, code: str, output_format: str, options: Dict[str, Any], destination: Path) -> None:
+        """Render via temporary files; the output format follows the suffix of ``destination``."""
+        mmd_file = temporary_path(destination.with_suffix(".mmd"))
+        output_file = temporary_path(destination)
+        try:
+            # Write Mermaid code to temp file
+            mmd_file.write_text(code, encoding='utf-8')
+            
+            run_renderer(
+                ["mmdc", "-i", str(mmd_file), "-o", str(output_file)]
+                + self.options(options, svg=output_format == "svg"),
+                self.timeout
+            )
+            os.replace(output_file, destination)
+        except subprocess.CalledProcessError as e:
+            raise RenderError(e.stderr or str(e), transient=is_transient_render_error(e)) from e
+        finally:
+            # Clean up temp files
+            for temporary in (mmd_file, output_file):
+                if temporary.exists():
+                    temporary.unlink()
+    
+    def validate(self, codes: List[str]) -> Optional[List[Optional[str]]]:
+        """Run ``mermaid.parse`` over all diagrams in one headless browser.
+
+        Uses the mermaid package and Puppeteer installed with the Mermaid
+        CLI, so the diagrams are checked by the same parser that renders
+        them. Returns None when they cannot be found; raises OSError when
+        the check itself fails.
+        """
+        mermaid_js = find_mermaid_js()
+        if mermaid_js is None or not shutil.which("node"):
+            return None
+        
+        script = self.cache_dir / ".mermaid-validate.js"
+        source = f"const validate = {DAEMON_VALIDATE_JS.strip()};\n{MMDC_VALIDATE_JS}"
+        if not script.exists() or script.read_text(encoding='utf-8') != source:
+            atomic_write(script, source.encode('utf-8'))
+        codes_file = temporary_path(self.cache_dir / "validate.json")
+        try:
+            codes_file.write_text(json.dumps(codes), encoding='utf-8')
+            result = run_renderer(["node", str(script), str(mermaid_js), str(codes_file)], self.timeout)
+            errors = json.loads(result.stdout)
+        except subprocess.CalledProcessError as e:
+            message = (e.stderr or "").strip()
+            raise OSError(message.splitlines()[0] if message else str(e)) from e
+        finally:
+            if codes_file.exists():
+                codes_file.unlink()
+        if not isinstance(errors, list) or len(errors) != len(codes):
+            raise ValueError("Malformed result from the Mermaid parser")
+        return errors
+
+
+class BrowserPoolRenderer(DiagramRenderer):
+    """Warm headless browser with a pool of tabs, served by a running ``RenderDaemon``."""
+    
+    name = "browser"
+    
+    def __init__(self, socket_path: Path, timeout: Optional[float], mmdc: MmdcRenderer):
+        self.socket_path = Path(socket_path)
+        self.client = RenderDaemonClient(self.socket_path, **({"timeout": timeout} if timeout else {}))
+        self.mmdc = mmdc
+        self.stats: Optional[Dict[str, Any]] = None
+    
+    def available(self) -> bool:
+        self.stats = self.client.stats()
+        return self.stats is not None
+    
+    def version(self) -> str:
+        # The daemon loads the mermaid.js of the Mermaid CLI install, so its
+        # output matches mmdc's and the two share cache entries
+        return self.mmdc.version()
+    
+    def render(self, code: str, output_format: str, options: Dict[str, Any], destination: Path) -> None:
+        try:
+            data = self.client.render(code, output_format, options)
+        except RuntimeError as e:
+            raise RenderError(str(e)) from e
+        except ValueError as e:
+            raise ConnectionError(f"Malformed response from the render daemon: {e}") from e
+        atomic_write(destination, data)
+    
+    def validate(self, codes: List[str]) -> Optional[List[Optional[str]]]:
+        return self.client.validate(codes)
+    
+    def describe(self) -> str:
+        renders = (self.stats or {}).get("renders", 0)
+        return f"browser pool at {self.socket_path} ({renders} renders served)"
+
+
+class KrokiRenderer(DiagramRenderer):
+    """HTTP renderer speaking the Kroki API, e.g. a local ``yuzutech/kroki`` container.
+
+    Diagrams are POSTed as plain text to ``<url>/mermaid/<format>``. Only the
+    theme is passed on, as a diagram option; the server chooses its own
+    viewport and resolution.
+    """
+    
+    name = "kroki"
+    applies_scale = False
+    
+    def __init__(self, url: str, timeout: Optional[float] = None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self._version: Optional[str] = None
+    
+    def health(self) -> Optional[Dict[str, Any]]:
+        """The server's health report, or None when it does not answer."""
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=2) as response:
+                return json.loads(response.read())
+        except (OSError, ValueError):
+            return None
+    
+    def available(self) -> bool:
+        health = self.health()
+        if health is None:
+            return False
+        version = health.get("version")
+        number = version.get("number") if isinstance(version, dict) else version
+        self._version = f"kroki {number or 'unknown'}"
+        return True
+    
+    def version(self) -> str:
+        if self._version is None and not self.available():
+            return "kroki unknown"
+        return self._version
+    
+    def render(self, code: str, output_format: str, options: Dict[str, Any], destination: Path) -> None:
+        request = urllib.request.Request(
+            f"{self.url}/mermaid/{output_format}", data=code.encode('utf-8'), method="POST",
+            headers={"Content-Type": "text/plain", "Kroki-Diagram-Options-Theme": str(options.get("theme", "default"))}
+        )
+        try:
+            with urllib.request.urlopen(request, **({"timeout": self.timeout} if self.timeout else {})) as response:
+                data = response.read()
+        except urllib.error.HTTPError as e:
+            message = e.read().decode('utf-8', 'replace').strip() or str(e)
+            # Syntax errors come back as 400; 429 and 5xx mean the server is struggling
+            raise RenderError(message, transient=e.code == 429 or e.code >= 500) from e
+        except urllib.error.URLError as e:
+            if isinstance(e.reason, socket.timeout):
+                raise RenderTimeout(f"Kroki did not answer within {self.timeout:g}s") from e
+            raise
+        except socket.timeout as e:
+            raise RenderTimeout(f"Kroki did not answer within {self.timeout:g}s") from e
+        atomic_write(destination, data)
+    
+    def describe(self) -> str:
+        return f"Kroki at {self.url} ({self.version()})"
+
+
+class GraphvizRenderer(DiagramRenderer):
+    """Graphviz ``dot``: a native binary, cheap enough to start once per diagram."""
+    
+    name = "graphviz"
+    
+    def __init__(self, cache_dir: Path, timeout: Optional[float] = None):
+        self.cache_dir = Path(cache_dir)
+        self.timeout = timeout
+        self._version: Optional[str] = None
+    
+    def available(self) -> bool:
+        return shutil.which("dot") is not None
+    
+    def version(self) -> str:
+        """Return the Graphviz version, looked up once per build (it is part of every cache key)."""
+        if self._version is None:
+            self._version = tool_version(self.cache_dir, ["dot", "-V"])
+        return self._version
+    
+    def render(self, code: str, output_format: str, options: Dict[str, Any], destination: Path) -> None:
+        source_file = temporary_path(destination.with_suffix(".dot"))
+        output_file = temporary_path(destination)
+        command = ["dot", f"-T{output_format}", f"-Gbgcolor={options['backgroundColor']}"]
+        if output_format == "png":
+            # Graph attributes in the source still take precedence over these defaults
+            command.append(f"-Gdpi={CSS_PIXELS_PER_INCH * float(options['scale']):g}")
+        try:
+            source_file.write_text(code, encoding='utf-8')
+            run_renderer(command + ["-o", str(output_file), str(source_file)], self.timeout)
+            os.replace(output_file, destination)
+        except subprocess.CalledProcessError as e:
+            raise RenderError(e.stderr or str(e), transient=e.returncode < 0) from e
+        finally:
+            for temporary in (source_file, output_file):
+                if temporary.exists():
+                    temporary.unlink()
+
+
+class PlantUmlRenderer(DiagramRenderer):
+    """PlantUML served by one JVM for the whole build.
+
+    Starting a JVM costs about a second per diagram, so the first render
+    starts PlantUML's built-in web server (``-picoweb``) on a free local
+    port and every diagram is then fetched from it over HTTP. ``close``
+    stops the server.
+    """
+    
+    name = "plantuml"
+    
+    def __init__(self, cache_dir: Path, timeout: Optional[float] = None):
+        self.cache_dir = Path(cache_dir)
+        self.timeout = timeout
+        self.command = plantuml_command()
+        self.server: Optional[subprocess.Popen] = None
+        self.url = ""
+        self.server_lock = threading.Lock()
+        self._version: Optional[str] = None
+    
+    def available(self) -> bool:
+        return self.command is not None
+    
+    def version(self) -> str:
+        """Return the PlantUML version, looked up once per build (it is part of every cache key)."""
+        if self._version is None:
+            if self.command is None:
+                self._version = "unknown"
+            else:
+                jar = os.environ.get("PLANTUML_JAR") if self.command[0] == "java" else None
+                self._version = tool_version(self.cache_dir, self.command + ["-version"], binary=jar)
+        return self._version
+    
+    def start_server(self) -> str:
+        """Base URL of the PlantUML server, starting it on first use."""
+        with self.server_lock:
+            if self.server is not None and self.server.poll() is None:
+                return self.url
+            if self.command is None:
+                raise FileNotFoundError("PlantUML not found; install it or set PLANTUML_JAR")
+            
+            with socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+            self.server = subprocess.Popen(self.command + [f"-picoweb:{port}:127.0.0.1"],
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                           shell=USE_SHELL, **process_group_options())
+            self.url = f"http://127.0.0.1:{port}"
+            
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    urllib.request.urlopen(f"{self.url}/", timeout=1).close()
+                    break
+                except urllib.error.HTTPError:
+                    # Any HTTP answer means the server is up
+                    break
+                except OSError:
+                    if self.server.poll() is not None:
+                        raise OSError(f"PlantUML server exited during startup (code {self.server.returncode})")
+                    if time.monotonic() > deadline:
+                        self.close()
+                        raise RenderTimeout("PlantUML server did not start within 60s")
+                    time.sleep(0.2)
+            print(f"☕ Started PlantUML server on port {port} (pid {self.server.pid})")
+            return self.url
+    
+    def render(self, code: str, output_format: str, options: Dict[str, Any], destination: Path) -> None:
+        source = code if code.lstrip().startswith("@start") else f"@startuml\n{code}\n@enduml"
+        if output_format == "png" and float(options["scale"]) != 1:
+            # Same effect as the Mermaid CLI's --scale
+            first_line, _, rest = source.partition("\n")
+            source = f"{first_line}\nscale {options['scale']}\n{rest}"
+        url = f"{self.start_server()}/plantuml/{output_format}/{plantuml_encode(source)}"
+        
+        try:
+            with urllib.request.urlopen(url, **({"timeout": self.timeout} if self.timeout else {})) as response:
+                headers, data = response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            headers, data = e.headers, b""
+            if not headers.get("X-PlantUML-Diagram-Error"):
+                raise RenderError(f"PlantUML server answered {e.code} {e.reason}", transient=e.code >= 500) from e
+        except socket.timeout as e:
+            raise RenderTimeout(f"PlantUML did not answer within {self.timeout:g}s") from e
+        
+        # Syntax errors still produce an image (of the error message)
+        error = headers.get("X-PlantUML-Diagram-Error")
+        if error:
+            line = headers.get("X-PlantUML-Diagram-Error-Line")
+            raise RenderError(f"{error} (line {line})" if line else error)
+        atomic_write(destination, data)
+    
+    def describe(self) -> str:
+        return f"PlantUML ({self.version()})"
+    
+    def close(self) -> None:
+        with self.server_lock:
+            if self.server is not None and self.server.poll() is None:
+                kill_process_group(self.server)
+                self.server.wait()
+            self.server = None
+
+
+class RemoteDiagramCache:
+    """Client of an HTTP content-addressed diagram cache.
+
+    Artifacts are addressed by file name (``diagram-<key>.<ext>``) under
+    ``<url>/diagram/``: GET fetches one, HEAD checks for one and PUT stores
+    one along with its SHA-256 in ``X-Checksum-Sha256``. Each thread keeps
+    one persistent connection. The first network or server error disables
+    the remote for the rest of the build, so an unreachable cache costs
+    one timeout and never fails a build.
+    """
+    
+    def __init__(self, url: str, read_only: bool = False, timeout: float = REMOTE_CACHE_TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Unsupported remote cache URL: {url}")
+        self.url = url
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.read_only = read_only
+        self.timeout = timeout
+        self.connections = threading.local()
+        self.lock = threading.Lock()
+        self.disabled = False
+        self.counters = {"hits": 0, "misses": 0, "uploads": 0}
+    
+    def connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self.connections, "connection", None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            connection = connection_class(self.host, self.port, timeout=self.timeout)
+            self.connections.connection = connection
+        return connection
+    
+    def request(self, method: str, name: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        """One request on this thread's connection; None once the remote is disabled."""
+        if self.disabled:
+            return None
+        # A kept-alive connection may have been closed by the server; retry once on a fresh one
+        for attempt in (1, 2):
+            connection = self.connection()
+            try:
+                connection.request(method, f"{self.base_path}/diagram/{name}", body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                self.connections.connection = None
+                if attempt == 2:
+                    self.disable(str(e) or type(e).__name__)
+                    return None
+                continue
+            if response.status >= 500:
+                self.disable(f"{response.status} {response.reason}")
+                return None
+            return response.status, dict(response.getheaders()), data
+        return None
+    
+    def disable(self, reason: str) -> None:
+        with self.lock:
+            if not self.disabled:
+                self.disabled = True
+                print(f"⚠️  Remote cache {self.url} unavailable ({reason}); continuing without it")
+    
+    def count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
+    
+    def fetch(self, name: str) -> Optional[bytes]:
+        """Contents of an artifact, or None when the remote does not have it (or sent it damaged)."""
+        result = self.request("GET", name)
+        if result is None or result[0] != 200:
+            return None
+        _, headers, data = result
+        checksum = {header.lower(): value for header, value in headers.items()}.get("x-checksum-sha256")
+        if checksum and hashlib.sha256(data).hexdigest() != checksum:
+            print(f"⚠️  Remote cache sent a damaged copy of {name}; ignoring it")
+            return None
+        return data
+    
+    def exists(self, name: str) -> bool:
+        result = self.request("HEAD", name)
+        return result is not None and result[0] == 200
+    
+    def store(self, name: str, data: bytes) -> bool:
+        """Upload an artifact unless the remote already has it; True when it was uploaded."""
+        if self.read_only or self.exists(name):
+            return False
+        result = self.request("PUT", name, data, {"X-Checksum-Sha256": hashlib.sha256(data).hexdigest(),
+                                                  "Content-Type": "application/octet-stream"})
+        return result is not None and result[0] in (200, 201, 204)
+
+
+class RemoteCacheHandler(http.server.BaseHTTPRequestHandler):
+    """Request handler of ``RemoteCacheServer``; see ``RemoteDiagramCache`` for the protocol."""
+    
+    protocol_version = "HTTP/1.1"
+    server_version = "doc-generator-cache/1"
+    
+    def target(self) -> Optional[Path]:
+        match = re.fullmatch(r'/diagram/([^/]+)', urllib.parse.urlsplit(self.path).path)
+        if not match or not DiagramCache.DIAGRAM_PATTERN.match(match.group(1)):
+            return None
+        return self.server.root / match.group(1)
+    
+    def respond(self, status: int, body: bytes = b"", headers: Optional[Dict[str, str]] = None,
+                send_body: bool = True) -> None:
+        self.send_response(status)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+    
+    def serve_file(self, send_body: bool) -> None:
+        target = self.target()
+        try:
+            data = target.read_bytes() if target else None
+        except FileNotFoundError:
+            data = None
+        if data is None:
+            self.respond(404, send_body=send_body)
+            return
+        headers = {"Content-Type": "application/octet-stream",
+                   "X-Checksum-Sha256": hashlib.sha256(data).hexdigest()}
+        if send_body:
+            self.respond(200, data, headers)
+        else:
+            # HEAD: the headers GET would send, without the body
+            self.send_response(200)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+    
+    def do_GET(self) -> None:
+        self.serve_file(send_body=True)
+    
+    def do_HEAD(self) -> None:
+        self.serve_file(send_body=False)
+    
+    def do_PUT(self) -> None:
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        target = self.target()
+        if target is None:
+            self.respond(404)
+            return
+        checksum = self.headers.get("X-Checksum-Sha256")
+        if checksum and hashlib.sha256(data).hexdigest() != checksum:
+            self.respond(400, b"Checksum mismatch\n")
+            return
+        # Content-addressed: the first upload of a name wins
+        if not target.exists():
+            atomic_write(target, data)
+        self.respond(201)
+    
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class RemoteCacheServer(http.server.ThreadingHTTPServer):
+    """Reference server of the remote diagram cache protocol, storing artifacts as plain files under ``root``.
+
+    Bind it to port 0 to run a throwaway stand-in inside tests.
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, root: Path, host: str = "127.0.0.1", port: int = 0, verbose: bool = False):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.verbose = verbose
+        super().__init__((host, port), RemoteCacheHandler)
+    
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class DiagramCache:
+    """SQLite index of the rendered diagrams in an image directory.
+
+    Every entry records the cache key, file name, render options, byte size,
+    render duration, creation time, last-used time, the number of the
+    last build that used it (see ``begin_build``) and whether its PNGs have
+    been optimized, plus its natural display width in inches (0 when not
+    known yet). Diagrams whose source the renderer rejected are recorded in a
+    separate ``failures`` table with the error text, under the same key, so
+    later builds need not try them again. The whole index is
+    loaded once when opened, so lookups and cleanup never have to stat or
+    list the (possibly network-mounted) image directory. The index is
+    rebuilt from the files on disk only when it is first created or when
+    ``resync`` is called.
+    """
+    
+    INDEX_NAME = ".cache-index.sqlite"
+    SCHEMA_VERSION = 5
+    # Statements upgrading an index from the keyed version to the next one
+    MIGRATIONS = {
+        1: ["ALTER TABLE diagrams ADD COLUMN last_build INTEGER NOT NULL DEFAULT 0"],
+        2: ["ALTER TABLE diagrams ADD COLUMN optimized INTEGER NOT NULL DEFAULT 0"],
+        3: ["ALTER TABLE diagrams ADD COLUMN display_width REAL NOT NULL DEFAULT 0"],
+        4: [],  # adds the failures table, created below
+    }
+    DIAGRAM_PATTERN = re.compile(r'diagram-([a-f0-9]{64}|[a-f0-9]{8})\.(png|svg)$')
+    ARTIFACT_SUFFIXES = (".svg", ".png")
+    
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        index_path = self.directory / self.INDEX_NAME
+        is_new = not index_path.exists()
+        
+        # Other builds may be writing to the same index; wait for their transactions
+        self.db = sqlite3.connect(str(index_path), timeout=60)
+        self.db.row_factory = sqlite3.Row
+        schema_version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if schema_version in self.MIGRATIONS:
+            for version in range(schema_version, self.SCHEMA_VERSION):
+                for statement in self.MIGRATIONS[version]:
+                    self.db.execute(statement)
+        elif schema_version != self.SCHEMA_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS diagrams")
+            is_new = True
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS diagrams (
+                key TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                options TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                render_seconds REAL NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                last_build INTEGER NOT NULL DEFAULT 0,
+                optimized INTEGER NOT NULL DEFAULT 0,
+                display_width REAL NOT NULL DEFAULT 0
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS failures (
+                key TEXT PRIMARY KEY,
+                error TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.db.commit()
+        self.build_number = self.last_build_number()
+        
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.failures: Dict[str, Dict[str, Any]] = {}
+        self.reload()
+        if is_new:
+            self.resync()
+    
+    def reload(self) -> None:
+        """Re-read the index, picking up entries written by other builds."""
+        self.entries = {row["key"]: dict(row) for row in self.db.execute("SELECT * FROM diagrams")}
+        self.failures = {row["key"]: dict(row) for row in self.db.execute("SELECT * FROM failures")}
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(key)
+    
+    def record(self, key: str, filename: str, options: Dict[str, Any], size: int, render_seconds: float,
+               created: Optional[float] = None, display_width: float = 0.0) -> None:
+        """Add or replace the entry of a freshly rendered diagram."""
+        now = time.time()
+        entry = {
+            "key": key, "filename": filename, "options": json.dumps(options, sort_keys=True),
+            "size": size, "render_seconds": render_seconds, "created": created or now, "last_used": now,
+            "last_build": self.build_number, "optimized": 0, "display_width": display_width,
+        }
+        self.db.execute(
+            "INSERT OR REPLACE INTO diagrams "
+            "(key, filename, options, size, render_seconds, created, last_used, last_build, optimized, display_width) "
+            "VALUES (:key, :filename, :options, :size, :render_seconds, :created, :last_used, :last_build, "
+            ":optimized, :display_width)",
+            entry
+        )
+        self.db.execute("DELETE FROM failures WHERE key = ?", (key,))
+        self.db.commit()
+        self.entries[key] = entry
+        self.failures.pop(key, None)
+    
+    def record_failure(self, key: str, error: str) -> None:
+        """Remember that the renderer rejected a diagram, and why."""
+        now = time.time()
+        entry = {"key": key, "error": error, "created": now, "last_used": now}
+        self.db.execute("INSERT OR REPLACE INTO failures VALUES (:key, :error, :created, :last_used)", entry)
+        self.db.commit()
+        self.failures[key] = entry
+    
+    def mark_optimized(self, key: str, size: int) -> None:
+        """Record that an entry's PNGs were optimized, and their new total size."""
+        self.db.execute("UPDATE diagrams SET optimized = 1, size = ? WHERE key = ?", (size, key))
+        self.db.commit()
+        self.entries[key].update(optimized=1, size=size)
+    
+    def set_display_width(self, key: str, display_width: float) -> None:
+        self.db.execute("UPDATE diagrams SET display_width = ? WHERE key = ?", (display_width, key))
+        self.db.commit()
+        self.entries[key]["display_width"] = display_width
+    
+    def last_build_number(self) -> int:
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'build_number'").fetchone()
+        return int(row["value"]) if row else 0
+    
+    def begin_build(self) -> int:
+        """Allocate the next build number; entries used by this build are tagged with it."""
+        self.build_number = self.last_build_number() + 1
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('build_number', ?)", (str(self.build_number),))
+        self.db.commit()
+        return self.build_number
+    
+    def touch(self, keys: Set[str]) -> None:
+        """Mark entries, and recorded failures, as used by the current build."""
+        now = time.time()
+        rendered = [key for key in keys if key in self.entries]
+        failed = [key for key in keys if key in self.failures]
+        self.db.executemany("UPDATE diagrams SET last_used = ?, last_build = ? WHERE key = ?",
+                            [(now, self.build_number, key) for key in rendered])
+        self.db.executemany("UPDATE failures SET last_used = ? WHERE key = ?", [(now, key) for key in failed])
+        self.db.commit()
+        for key in rendered:
+            self.entries[key]["last_used"] = now
+            self.entries[key]["last_build"] = self.build_number
+        for key in failed:
+            self.failures[key]["last_used"] = now
+    
+    def evict(self, max_bytes: Optional[int], max_age: Optional[float], keep_builds: int) -> List[Dict[str, Any]]:
+        """Apply the eviction policy and delete the evicted files.
+
+        Entries used by any of the last ``keep_builds`` builds are never
+        evicted. Of the rest, anything not used for ``max_age`` seconds goes
+        first, then least-recently-used entries until the cache fits in
+        ``max_bytes``. Recorded failures not looked up for ``max_age`` seconds
+        are dropped as well. Returns the evicted entries.
+        """
+        now = time.time()
+        if max_age is not None:
+            expired_failures = [key for key, failure in self.failures.items() if now - failure["last_used"] > max_age]
+            self.db.executemany("DELETE FROM failures WHERE key = ?", [(key,) for key in expired_failures])
+            self.db.commit()
+            for key in expired_failures:
+                del self.failures[key]
+        
+        oldest_protected_build = self.build_number - max(1, keep_builds) + 1
+        candidates = sorted(
+            (entry for entry in self.entries.values() if entry["last_build"] < oldest_protected_build),
+            key=lambda entry: entry["last_used"]
+        )
+        total_bytes = self.total_bytes()
+        
+        evicted = []
+        for entry in candidates:
+            expired = max_age is not None and now - entry["last_used"] > max_age
+            oversized = max_bytes is not None and total_bytes > max_bytes
+            if not (expired or oversized):
+                continue
+            artifacts = [self.directory / f"diagram-{entry['key']}{suffix}" for suffix in self.ARTIFACT_SUFFIXES]
+            for path in artifacts + [self.lock_path(entry["key"])]:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            self.remove(entry["key"])
+            total_bytes -= entry["size"]
+            evicted.append(entry)
+        
+        return evicted
+    
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self.entries.values())
+    
+    def lock_path(self, key: str) -> Path:
+        """Lock file held while a diagram is being rendered, so only one process renders it."""
+        return self.directory / "locks" / f"{key}.lock"
+    
+    def usage_lock(self) -> FileLock:
+        """Held shared by builds using the cache, exclusively while evicting."""
+        return FileLock(self.directory / ".cache.lock")
+    
+    def remove(self, key: str) -> None:
+        self.db.execute("DELETE FROM diagrams WHERE key = ?", (key,))
+        self.db.commit()
+        self.entries.pop(key, None)
+    
+    def entries_not_in(self, keys: Set[str]) -> List[Dict[str, Any]]:
+        return [entry for key, entry in self.entries.items() if key not in keys]
+    
+    def artifact_paths(self, key: str) -> List[Path]:
+        """Files stored for an entry, SVG (the primary artifact) first."""
+        paths = [self.directory / f"diagram-{key}{suffix}" for suffix in self.ARTIFACT_SUFFIXES]
+        return [path for path in paths if path.exists()]
+    
+    def export_bundle(self, bundle: Path, recent_builds: Optional[int] = None) -> Tuple[int, int]:
+        """Pack entries and a manifest with their SHA-256 checksums into a gzipped tar archive.
+
+        With ``recent_builds`` only entries used by that many most recent
+        builds are exported. The manifest is the first member, so importing
+        can check every file as it streams past. Returns (entries, bytes).
+        """
+        oldest_build = self.build_number - recent_builds + 1 if recent_builds else 0
+        entries = []
+        for entry in self.entries.values():
+            if entry["last_build"] < oldest_build:
+                continue
+            paths = self.artifact_paths(entry["key"])
+            if not paths:
+                continue
+            checksums = {path.name: hashlib.sha256(path.read_bytes()).hexdigest() for path in paths}
+            entries.append((dict(entry, files=checksums), paths))
+        
+        manifest = json.dumps({
+            "version": CACHE_BUNDLE_VERSION,
+            "created": time.time(),
+            "entries": [entry for entry, _ in entries],
+        }, indent=1).encode('utf-8')
+        
+        partial = temporary_path(bundle)
+        try:
+            with tarfile.open(partial, "w:gz", compresslevel=6) as archive:
+                info = tarfile.TarInfo("manifest.json")
+                info.size = len(manifest)
+                info.mtime = int(time.time())
+                archive.addfile(info, io.BytesIO(manifest))
+                for _, paths in entries:
+                    for path in paths:
+                        archive.add(str(path), arcname=f"diagrams/{path.name}", recursive=False)
+            os.replace(partial, bundle)
+        finally:
+            if partial.exists():
+                partial.unlink()
+        return len(entries), bundle.stat().st_size
+    
+    def import_bundle(self, bundle: Path) -> Dict[str, int]:
+        """Unpack an archive written by ``export_bundle``, verifying every file's checksum.
+
+        Entries already in the cache are left untouched, and so is any entry
+        whose files are missing or fail verification. Entries whose key or
+        file names are not those of a cache entry (see ``valid_bundle_entry``)
+        are rejected before anything is written. Returns counts of imported,
+        skipped and corrupt entries.
+        """
+        counts = {"imported": 0, "skipped": 0, "corrupt": 0}
+        with tarfile.open(bundle, "r:gz") as archive:
+            first = archive.next()
+            if first is None or first.name != "manifest.json":
+                raise ValueError(f"{bundle} is not a diagram cache bundle (no manifest)")
+            manifest = json.loads(archive.extractfile(first).read())
+            if manifest.get("version") != CACHE_BUNDLE_VERSION:
+                raise ValueError(f"Unsupported cache bundle version: {manifest.get('version')}")
+            
+            wanted: Dict[str, Tuple[Dict[str, Any], str]] = {}
+            entries = []
+            for entry in manifest["entries"]:
+                if not self.valid_bundle_entry(entry):
+                    counts["corrupt"] += 1
+                    key = entry.get("key") if isinstance(entry, dict) else None
+                    print(f"⚠️  Invalid bundle entry {str(key)[:80]!r}; not importing it")
+                    continue
+                if entry["key"] in self.entries:
+                    counts["skipped"] += 1
+                    continue
+                entries.append(entry)
+                for name, checksum in entry["files"].items():
+                    wanted[name] = (entry, checksum)
+            
+            # Files are written under temporary names and only renamed into
+            # place once every file of their entry has been verified
+            received: Dict[str, Dict[str, Path]] = {}
+            try:
+                for member in archive:
+                    name = member.name[len("diagrams/"):] if member.name.startswith("diagrams/") else ""
+                    if not member.isfile() or name not in wanted or not self.DIAGRAM_PATTERN.match(name):
+                        continue
+                    entry, checksum = wanted[name]
+                    partial = temporary_path(self.directory / name)
+                    digest = hashlib.sha256()
+                    with archive.extractfile(member) as source, open(partial, "wb") as target:
+                        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                            digest.update(chunk)
+                            target.write(chunk)
+                    if digest.hexdigest() != checksum:
+                        partial.unlink()
+                        print(f"⚠️  Checksum mismatch for {name}; not importing it")
+                        continue
+                    received.setdefault(entry["key"], {})[name] = partial
+                
+                for entry in entries:
+                    files = received.pop(entry["key"], {})
+                    if set(files) != set(entry["files"]):
+                        counts["corrupt"] += 1
+                        for partial in files.values():
+                            partial.unlink()
+                        continue
+                    self.import_entry(entry, files)
+                    counts["imported"] += 1
+            finally:
+                for files in received.values():
+                    for partial in files.values():
+                        if partial.exists():
+                            partial.unlink()
+        return counts
+    
+    def valid_bundle_entry(self, entry: Any) -> bool:
+        """Whether a bundle manifest entry has a SHA-256 cache key and only that key's files.
+
+        The key ends up in file names (its render lock) and in the index, so
+        anything else, such as ``../`` in a tampered manifest, is refused.
+        """
+        if not isinstance(entry, dict) or not isinstance(entry.get("key"), str):
+            return False
+        if not re.fullmatch(r'[a-f0-9]{64}', entry["key"]):
+            return False
+        files = entry.get("files")
+        allowed = {f"diagram-{entry['key']}{suffix}" for suffix in self.ARTIFACT_SUFFIXES}
+        return (isinstance(files, dict) and bool(files) and set(files) <= allowed
+                and all(isinstance(checksum, str) for checksum in files.values())
+                and entry.get("filename") in files)
+    
+    def import_entry(self, entry: Dict[str, Any], files: Dict[str, Path]) -> None:
+        """Move verified files of an imported entry into place and index it, unless a build got there first."""
+        lock = FileLock(self.lock_path(entry["key"]))
+        if not lock.acquire(timeout=LOCK_TIMEOUT):
+            raise TimeoutError(f"Timed out waiting for the render lock of {entry['key']}")
+        try:
+            if self.db.execute("SELECT 1 FROM diagrams WHERE key = ?", (entry["key"],)).fetchone():
+                for partial in files.values():
+                    partial.unlink()
+                return
+            for name, partial in files.items():
+                os.replace(partial, self.directory / name)
+            self.record(entry["key"], entry["filename"], json.loads(entry["options"]), entry["size"],
+                        entry["render_seconds"], created=entry["created"], display_width=entry["display_width"])
+            if entry["optimized"]:
+                self.mark_optimized(entry["key"], entry["size"])
+        finally:
+            lock.release()
+    
+    def resync(self) -> None:
+        """Rebuild the index from the diagram files actually present on disk."""
+        on_disk: Dict[str, List[Path]] = {}
+        for path in self.directory.iterdir():
+            match = self.DIAGRAM_PATTERN.match(path.name)
+            if match:
+                on_disk.setdefault(match.group(1), []).append(path)
+        
+        added = 0
+        for key, paths in on_disk.items():
+            if key not in self.entries:
+                # The SVG is the primary artifact when both formats are present
+                paths.sort(key=lambda path: self.ARTIFACT_SUFFIXES.index(path.suffix))
+                stats = [path.stat() for path in paths]
+                # Options of files found on disk are unknown; the key already covers them
+                self.record(key, paths[0].name, {}, sum(stat.st_size for stat in stats), 0.0,
+                            created=stats[0].st_mtime)
+                added += 1
+        
+        stale = [key for key in self.entries if key not in on_disk]
+        for key in stale:
+            self.remove(key)
+        
+        if added or stale:
+            print(f"🔁 Re-synced diagram cache index: {added} added, {len(stale)} dropped")
+
+
+def available_memory() -> Optional[int]:
+    """Bytes of memory the host can still hand out without swapping, or None when unknown."""
+    try:
+        with open("/proc/meminfo", encoding="ascii") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_jobs(adaptive: bool) -> int:
+    """Render concurrency when --jobs is not given: one per CPU only when it can adapt to free memory."""
+    return DEFAULT_JOBS if adaptive and available_memory() is not None else MODEST_JOBS
+
+
+def host_load() -> Optional[float]:
+    """One-minute load average, or None where the platform has none."""
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+class AdaptiveConcurrency:
+    """Render slots whose number follows free memory and CPU load.
+
+    Before each render starts, the limit is recomputed: no more renders
+    than idle CPUs (the load average minus our own renders), and no more
+    than fit into the available memory minus ``MEMORY_RESERVE`` at the
+    observed peak memory per render. That peak is measured by sampling
+    how far available memory drops below its idle level while renders
+    run. The limit stays between 1 and ``ceiling``; with ``adaptive`` off
+    it is simply ``ceiling``.
+    """
+    
+    def __init__(self, ceiling: int, adaptive: bool = True):
+        self.ceiling = max(1, ceiling)
+        self.adaptive = adaptive
+        self.cpus = os.cpu_count() or 1
+        self.condition = threading.Condition()
+        self.active = 0
+        self.closed = False
+        self.baseline = available_memory()
+        self.peak_per_render: Optional[int] = None
+        self.memory_limited = 0
+        self.limit = self.compute_limit() if adaptive else self.ceiling
+        self.initial_limit = self.limit
+        self.lowest = self.highest = self.limit
+        self.sampler: Optional[threading.Thread] = None
+    
+    def __enter__(self) -> "AdaptiveConcurrency":
+        if self.adaptive:
+            self.sampler = threading.Thread(target=self.sample_loop, daemon=True)
+            self.sampler.start()
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+        if self.sampler:
+            self.sampler.join()
+    
+    def memory_per_render(self) -> int:
+        return self.peak_per_render or DEFAULT_RENDER_MEMORY
+    
+    def sample(self) -> None:
+        """Update the idle memory level or the peak memory per render (caller holds the condition)."""
+        available = available_memory()
+        if available is None:
+            return
+        if self.active == 0:
+            self.baseline = available
+        elif self.baseline is not None:
+            per_render = max(0, self.baseline - available) // self.active
+            if per_render > (self.peak_per_render or 0):
+                self.peak_per_render = per_render
+    
+    def compute_limit(self) -> int:
+        """Renders allowed to run right now (caller holds the condition)."""
+        limit = self.ceiling
+        load = host_load()
+        if load is not None:
+            # Our own renders count towards the load, so only the rest of the host pushes the limit down
+            others = max(0.0, load - self.active)
+            limit = min(limit, int(self.cpus - others + 0.5))
+        available = available_memory()
+        if available is not None:
+            memory_limit = self.active + (available - MEMORY_RESERVE) // self.memory_per_render()
+            if memory_limit < limit:
+                limit = int(memory_limit)
+                self.memory_limited += 1
+        return max(1, limit)
+    
+    def update_limit(self) -> None:
+        self.sample()
+        self.limit = self.compute_limit()
+        self.lowest = min(self.lowest, self.limit)
+        self.highest = max(self.highest, self.limit)
+    
+    def acquire(self) -> bool:
+        """Wait for a render slot; False once the pool is closed."""
+        with self.condition:
+            while not self.closed:
+                if self.adaptive:
+                    self.update_limit()
+                if self.active < self.limit:
+                    self.active += 1
+                    return True
+                # Memory may be freed without one of our renders finishing
+                self.condition.wait(CONCURRENCY_SAMPLE_INTERVAL)
+            return False
+    
+    def release(self) -> None:
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+    
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+    
+    def sample_loop(self) -> None:
+        with self.condition:
+            while not self.closed:
+                self.sample()
+                self.condition.wait(CONCURRENCY_SAMPLE_INTERVAL)
+    
+    def summary(self) -> str:
+        if not self.adaptive:
+            return f"{self.ceiling} worker(s) (fixed)"
+        text = f"started with {self.initial_limit}, ranged {self.lowest}-{self.highest} of {self.ceiling} worker(s)"
+        if self.peak_per_render:
+            text += f", peak {format_size(self.peak_per_render)} per render"
+        if self.memory_limited:
+            text += ", held back by free memory"
+        return text
 
 
 class DocumentationGenerator:
-    def __init__(self, root_dir: str, output_dir: str = "build", output_filename: str = "output.docx", template_doc: str = None):
+    def __init__(self, root_dir: str, output_dir: str = "build", output_filename: str = "output.docx", template_doc: str = None,
+                 jobs: Optional[int] = None, batch: bool = False, daemon_socket: Optional[str] = None,
+                 use_daemon: bool = True, resync_cache: bool = False, cache_dir: Optional[str] = None,
+                 cache_max_bytes: Optional[int] = DEFAULT_CACHE_MAX_BYTES,
+                 cache_max_age: Optional[float] = DEFAULT_CACHE_MAX_AGE,
+                 cache_keep_builds: int = DEFAULT_CACHE_KEEP_BUILDS, diagram_format: str = "png",
+                 optimize_png: bool = False, fit_page: bool = False, diagram_dpi: int = DEFAULT_DIAGRAM_DPI,
+                 render_timeout: Optional[float] = DEFAULT_RENDER_TIMEOUT, render_retries: int = DEFAULT_RENDER_RETRIES,
+                 max_failures: Optional[int] = None, retry_failed: bool = False, validate: bool = True,
+                 renderer: str = "auto", kroki_url: Optional[str] = None, remote_cache: Optional[str] = None,
+                 remote_cache_read_only: bool = False, adaptive_jobs: bool = True, rebuild: bool = False,
+                 exclude: Optional[List[str]] = None, use_git: bool = False):
         self.root = Path(root_dir)
         self.output_dir = Path(output_dir)
         self.template_doc = Path(template_doc) if template_doc else None
+        self.jobs = max(1, jobs) if jobs else default_jobs(adaptive_jobs)
+        # Concurrency below self.jobs follows host memory and load, see AdaptiveConcurrency
+        self.adaptive_jobs = adaptive_jobs
+        self.concurrency: Optional[AdaptiveConcurrency] = None
+        self.batch = batch
+        self.render_options = dict(DEFAULT_RENDER_OPTIONS)
+        if diagram_format not in DIAGRAM_FORMATS:
+            raise ValueError(f"Unsupported diagram format: {diagram_format}")
+        self.diagram_format = diagram_format
+        self.optimize_png = optimize_png
+        self.daemon_socket = Path(daemon_socket) if daemon_socket else default_daemon_socket()
+        self.use_daemon = use_daemon
+        if renderer not in RENDERERS:
+            raise ValueError(f"Unknown renderer: {renderer}")
+        self.renderer_name = renderer
+        # Only probed in auto mode when configured; --renderer kroki falls back to the default URL
+        self.kroki_url = kroki_url
+        # Chosen on first use, see select_renderer
+        self.renderer: Optional[DiagramRenderer] = None
+        self.fallback_renderer: Optional[DiagramRenderer] = None
+        # Diagrams the fallback renderer produced this build; they are keyed by its version
+        self.fallback_renders: Set[str] = set()
+        
+        # Hung renderers are killed after render_timeout seconds (None: never),
+        # transient failures retried, and the build aborted after max_failures
+        self.render_timeout = render_timeout or None
+        self.render_retries = max(0, render_retries)
+        self.max_failures = max_failures
+        self.render_events = {"timeouts": 0, "retries": 0}
+        self.render_events_lock = threading.Lock()
+        # Diagrams that failed in an earlier build are skipped unless asked to retry
+        self.retry_failed = retry_failed
+        # Check every diagram before the first render starts
+        self.validate = validate
         
         # Ensure output filename has .docx extension
         if not output_filename.lower().endswith('.docx'):
@@ -32,23 +2189,82 @@ class DocumentationGenerator:
         self.img_dir = self.output_dir / "images"
         self.output_doc = self.output_dir / output_filename
         
-        # Ensure directories exist
-        self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.img_dir.mkdir(parents=True, exist_ok=True)
+        # Processed Markdown of each source file, keyed by its content hash,
+        # so unchanged files are not scanned again (see process_markdown_files)
+        self.processed_dir = self.output_dir / ".processed"
+        self.used_sources: Set[str] = set()
+        self.source_signatures: Dict[str, str] = {}
+        
+        # Inputs of the last complete build; when none changed, nothing is redone
+        self.manifest_file = self.output_dir / ".build-manifest.json"
+        self.previous_manifest: Optional[Dict[str, Any]] = None
+        self.rebuild = rebuild
+        self.languages: Set[str] = set()
+        self.diagram_failures = 0
+        
+        # Content-addressed diagram store, shared by every build on the machine
+        # unless it is pointed at the output images directory
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.shared_cache = self.cache_dir.resolve() != self.img_dir.resolve()
+        self.used_images: Set[str] = set()
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_age = cache_max_age
+        self.cache_keep_builds = cache_keep_builds
+        self.output_lock = FileLock(self.output_dir / ".build.lock")
+        
+        # Markdown discovery: exclude patterns from the command line and .docignore,
+        # and the output and cache directories when they sit inside the root
+        self.use_git = use_git
+        self.exclude_patterns = list(exclude or []) + self.read_docignore()
+        self.exclude_names, self.exclude_paths = self.compile_excludes(self.exclude_patterns)
+        self.excluded_dirs = set()
+        for directory in (self.output_dir, self.cache_dir):
+            try:
+                self.excluded_dirs.add(directory.resolve().relative_to(self.root.resolve()).as_posix())
+            except ValueError:
+                pass
+        
+        # Shared HTTP cache consulted for local misses and filled with new renders
+        self.remote = RemoteDiagramCache(remote_cache, read_only=remote_cache_read_only) if remote_cache else None
+        
+        # Graphviz and PlantUML always use their native tools
+        self.native_renderers: Dict[str, DiagramRenderer] = {
+            "graphviz": GraphvizRenderer(self.cache_dir, self.render_timeout),
+            "plantuml": PlantUmlRenderer(self.cache_dir, self.render_timeout),
+        }
+        
+        # Index of rendered diagrams; rebuilt from disk only when asked to
+        self.cache = DiagramCache(self.cache_dir)
+        if resync_cache:
+            self.cache.resync()
+        
+        # Optionally lay diagrams out for the usable page width at the target
+        # resolution instead of the fixed 1200x800 viewport at 2x. Opt-in, as it
+        # changes the render options and so every cache key
+        self.page_geometry = self.read_template_geometry()
+        self.image_widths: Dict[str, float] = {}
+        if fit_page:
+            scale = round(diagram_dpi / CSS_PIXELS_PER_INCH, 3)
+            self.render_options.update(
+                scale=int(scale) if scale == int(scale) else scale,
+                width=round(self.page_geometry["width"] * CSS_PIXELS_PER_INCH),
+                height=round(self.page_geometry["height"] * CSS_PIXELS_PER_INCH),
+            )
     
-    def validate_dependencies(self) -> None:
+    def validate_dependencies(self, need_pandoc: bool = True) -> None:
         """Check if required tools are installed."""
         missing_tools = []
         
         # Check Pandoc
-        if not shutil.which("pandoc"):
+        if need_pandoc and not shutil.which("pandoc"):
             missing_tools.append("pandoc")
         
-        # Check Mermaid CLI with Windows-specific handling
-        mmdc_found = False
+        # Check Mermaid CLI with Windows-specific handling; other renderers do without it
+        mmdc_found = not isinstance(self.select_renderer(), MmdcRenderer)
         
         # First try standard detection
-        if shutil.which("mmdc"):
+        if mmdc_found or shutil.which("mmdc"):
             mmdc_found = True
         else:
             # Windows fallback: try testing the command directly
@@ -98,19 +2314,102 @@ class DocumentationGenerator:
         # Apply natural sorting to the entire path
         return self.natural_sort_key(relative_path)
     
+    def read_docignore(self) -> List[str]:
+        """Exclude patterns of the root's .docignore file (blank lines and # comments skipped)."""
+        try:
+            lines = (self.root / DOCIGNORE_FILE).read_text(encoding='utf-8').splitlines()
+        except OSError:
+            return []
+        return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+    
+    @staticmethod
+    def compile_excludes(patterns: List[str]) -> Tuple[Optional[re.Pattern], Optional[re.Pattern]]:
+        """Split glob patterns into one regex for names and one for paths relative to the root.
+
+        Like .gitignore, a pattern without a slash matches a file or
+        directory name anywhere in the tree, a pattern with one matches the
+        relative path, and a trailing slash is ignored (excluding a
+        directory excludes everything in it).
+        """
+        names, paths = [], []
+        for pattern in patterns:
+            pattern = pattern.rstrip("/")
+            if "/" in pattern:
+                paths.append(fnmatch.translate(pattern.lstrip("/")))
+            elif pattern:
+                names.append(fnmatch.translate(pattern))
+        return (re.compile("|".join(names)) if names else None,
+                re.compile("|".join(paths)) if paths else None)
+    
+    def is_excluded(self, relative: str, name: str, is_dir: bool) -> bool:
+        """Whether a file or directory (``relative`` is its POSIX path below the root) is left out."""
+        if is_dir and (name in DEFAULT_EXCLUDED_DIRS or relative in self.excluded_dirs):
+            return True
+        return bool((self.exclude_names and self.exclude_names.match(name))
+                    or (self.exclude_paths and self.exclude_paths.match(relative)))
+    
+    def walk_markdown_files(self) -> List[Path]:
+        """Find .md files with ``os.scandir``, never descending into excluded directories."""
+        md_files = []
+        stack = [(str(self.root), "")]
+        while stack:
+            directory, prefix = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        relative = prefix + entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if not self.is_excluded(relative, entry.name, True):
+                                stack.append((entry.path, relative + "/"))
+                        elif (entry.name.endswith(".md") and entry.is_file()
+                              and not self.is_excluded(relative, entry.name, False)):
+                            md_files.append(Path(entry.path))
+            except OSError as e:
+                print(f"⚠️  Warning: Could not list {directory}: {e}")
+        return md_files
+    
+    def git_markdown_files(self) -> Optional[List[Path]]:
+        """.md files git knows about (tracked, or untracked and not ignored), or None outside a work tree."""
+        try:
+            result = subprocess.run(
+                ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard", "--", "*.md"],
+                cwd=self.root, capture_output=True, shell=USE_SHELL, check=True
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            error = e.stderr.decode('utf-8', 'replace').strip() if isinstance(e, subprocess.CalledProcessError) else e
+            print(f"⚠️  git ls-files failed ({error}); searching the directory tree instead")
+            return None
+        
+        md_files = []
+        for relative in sorted(set(os.fsdecode(path) for path in result.stdout.split(b"\0") if path)):
+            parts = relative.split("/")
+            # Apply the directory rules to every parent, as the walker would have pruned them
+            if any(self.is_excluded("/".join(parts[:n]), parts[n - 1], True) for n in range(1, len(parts))):
+                continue
+            if self.is_excluded(relative, parts[-1], False):
+                continue
+            path = self.root / relative
+            # Tracked files deleted from the work tree are still listed
+            if path.is_file():
+                md_files.append(path)
+        return md_files
+    
     def collect_markdown_files(self) -> List[Path]:
-        """Collect all .md files in alphabetical order."""
+        """Collect all .md files in alphabetical order, skipping excluded files and directories."""
         if not self.root.exists():
             raise FileNotFoundError(f"Root directory not found: {self.root}")
         
-        md_files = list(self.root.rglob("*.md"))
+        started = time.perf_counter()
+        md_files = self.git_markdown_files() if self.use_git else None
+        if md_files is None:
+            md_files = self.walk_markdown_files()
         if not md_files:
             raise FileNotFoundError(f"No .md files found in {self.root}")
         
         # Sort alphabetically by full path
         md_files.sort(key=self.depth_and_name_sort_key)
         
-        print(f"📄 Found {len(md_files)} Markdown files (alphabetical order):")
+        print(f"📄 Found {len(md_files)} Markdown files in {time.perf_counter() - started:.2f}s (alphabetical order):")
         for file in md_files:
             relative_path = file.relative_to(self.root)
             depth = len(relative_path.parts) - 1
@@ -119,169 +2418,1186 @@ class DocumentationGenerator:
         
         return md_files
     
-    def concatenate_files(self, md_files: List[Path]) -> str:
-        """Concatenate all Markdown files into a single string."""
-        full_md = ""
+    def concatenate_files(self, md_files: List[Path], destination: Path) -> None:
+        """Stream all Markdown files into ``destination``, one chunk at a time.
+
+        Memory use does not grow with the size of the tree. A file that
+        turns out not to be UTF-8 part way through is cut off again and
+        skipped, as if it had never been read.
+        """
+        with open(destination, "w", encoding='utf-8') as combined:
+            for file in md_files:
+                file_start = combined.tell()
+                try:
+                    # Add file header for reference
+                    relative_path = file.relative_to(self.root)
+                    combined.write(f"\n\n<!-- Source: {relative_path} -->\n\n")
+                    
+                    # Copy file content
+                    with open(file, encoding='utf-8') as source:
+                        for chunk in iter(lambda: source.read(CONCAT_CHUNK_SIZE), ""):
+                            combined.write(chunk)
+                    
+                    # Ensure proper spacing between files
+                    combined.write("\n\n")
+                    
+                except UnicodeDecodeError:
+                    print(f"⚠️  Warning: Could not read {file} (encoding issue)")
+                    combined.seek(file_start)
+                    combined.truncate()
+                    continue
+                except Exception as e:
+                    print(f"⚠️  Warning: Error reading {file}: {e}")
+                    combined.seek(file_start)
+                    combined.truncate()
+                    continue
+    
+    def extract_diagram_blocks(self, lines: Iterable[str]) -> List[Tuple[int, int, str, str]]:
+        """Extract diagram code blocks from Markdown lines as (start, end, code, language) tuples, see ``tokenize_fences``."""
+        return [token[1] for token in tokenize_fences(lines) if token[0] == "diagram"]
+    
+    def hash_source(self, file: Path) -> Optional[str]:
+        """SHA-256 of a source file's bytes, or None when it cannot be read."""
+        digest = hashlib.sha256()
+        try:
+            with open(file, "rb") as source:
+                for chunk in iter(lambda: source.read(CONCAT_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        except OSError as e:
+            print(f"⚠️  Warning: Error reading {file}: {e}")
+            return None
+        return digest.hexdigest()
+    
+    def tokenize_source(self, file: Path) -> Optional[List[Tuple[Any, ...]]]:
+        """The diagram tokens of a source file (see ``tokenize_fences``), or None when it is not UTF-8."""
+        try:
+            with open(file, encoding='utf-8') as lines:
+                return [token for token in tokenize_fences(lines) if token[0] == "diagram"]
+        except UnicodeDecodeError:
+            print(f"⚠️  Warning: Could not read {file} (encoding issue)")
+        except OSError as e:
+            print(f"⚠️  Warning: Error reading {file}: {e}")
+        return None
+    
+    def source_signature(self, language: str) -> str:
+        """Everything besides the source that decides the image references of ``language`` diagrams."""
+        if language not in self.source_signatures:
+            settings = {
+                "key_version": CACHE_KEY_VERSION,
+                "processing": MARKDOWN_PROCESSING_VERSION,
+                "format": self.diagram_format,
+                "options": self.diagram_options(language),
+                "renderer": self.renderer_version(language),
+                "page_width": self.page_geometry["width"],
+            }
+            self.source_signatures[language] = hashlib.sha256(
+                json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+        return self.source_signatures[language]
+    
+    def reusable_diagrams(self, key: str) -> Optional[List[Tuple[str, str]]]:
+        """(hash, language) of each diagram of a memoized source file, or None when its processed Markdown must be redone.
+
+        The memo is only good while every render setting it was made with
+        still applies and all its diagrams are still indexed; a memo that
+        cannot be read or lacks any of its fields counts as stale. Callers
+        hold the cache usage lock, so the diagrams cannot be evicted between
+        this check and their use.
+        """
+        try:
+            memo = json.loads((self.processed_dir / f"{key}.json").read_text(encoding='utf-8'))
+            if not (self.processed_dir / f"{key}.md").exists():
+                return None
+            diagrams = []
+            for content_hash, language in memo["diagrams"]:
+                if memo["signatures"].get(language) != self.source_signature(language) or content_hash not in self.cache:
+                    return None
+                diagrams.append((content_hash, language))
+            return diagrams
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+    
+    def write_processed(self, file: Path, key: str, tokens: List[Tuple[Any, ...]], image_paths: List[str]) -> None:
+        """Write a source file's processed Markdown, memoizing it unless one of its diagrams failed."""
+        blocks = {match[0]: (match[1], img_path, indent)
+                  for (_, match, _, indent), img_path in zip(tokens, image_paths)}
+        processed = self.processed_dir / f"{key}.md"
+        temporary = temporary_path(processed)
+        skip_until = 0
+        with open(file, encoding='utf-8') as lines, open(temporary, "w", encoding='utf-8') as output:
+            for number, line in enumerate(lines):
+                if number < skip_until:
+                    continue
+                if number not in blocks:
+                    output.write(line)
+                    continue
+                skip_until, img_path, indent = blocks[number]
+                # Blank lines keep the block quote markers, so a quote is not split in two,
+                # but not a list marker the fence shared its line with
+                blank = re.match(r'(?: {0,3}> ?)*', indent).group().rstrip()
+                if img_path.startswith("["):
+                    # Failed generation - use placeholder
+                    output.write(f"{blank}\n{indent}{img_path}\n{blank}\n")
+                else:
+                    # No caption - just the image, indented like the block so it stays in its list item or quote
+                    output.write(f"{blank}\n{indent}{self.image_reference(img_path)}\n{blank}\n")
+        os.replace(temporary, processed)
         
-        for file in md_files:
+        memo = self.processed_dir / f"{key}.json"
+        if any(img_path.startswith("[") for img_path in image_paths):
+            # Failed diagrams are retried by the next build
+            memo.unlink(missing_ok=True)
+            return
+        diagrams = [(self.generate_content_hash(match[2], match[3]), match[3]) for _, match, _, _ in tokens]
+        atomic_write(memo, json.dumps({
+            "diagrams": diagrams,
+            "signatures": {language: self.source_signature(language) for _, language in diagrams},
+        }).encode('utf-8'))
+    
+    def hash_sources(self, md_files: List[Path]) -> List[Optional[str]]:
+        """Content hash of every source file (None for unreadable ones), computed in parallel."""
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            return list(pool.map(self.hash_source, md_files))
+    
+    def process_markdown_files(self, md_files: List[Path], keys: List[Optional[str]]) -> List[Tuple[Path, str]]:
+        """Turn every source file into processed Markdown with image references, reusing unchanged files.
+
+        ``keys`` are the files' content hashes (see ``hash_sources``); a file
+        whose memoized output is still valid (see ``reusable_diagrams``)
+        costs nothing more. The others are tokenized independently and in
+        parallel, their diagrams are rendered together, and their processed
+        Markdown is memoized. Returns the readable files with their content
+        hashes, in order.
+        """
+        # The cache is in shared use from the first memo check until the
+        # images are linked, so no other build evicts reused diagrams meanwhile
+        usage_lock = self.cache.usage_lock()
+        usage_lock.acquire(shared=True)
+        try:
+            return self._process_markdown_files(md_files, keys)
+        finally:
+            usage_lock.release()
+    
+    def _process_markdown_files(self, md_files: List[Path], keys: List[Optional[str]]) -> List[Tuple[Path, str]]:
+        self.cache.reload()
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            reused: Set[str] = set()
+            reused_files = 0
+            changed = []
+            for file, key in zip(md_files, keys):
+                if key is None:
+                    continue
+                diagrams = self.reusable_diagrams(key)
+                if diagrams is None:
+                    changed.append((file, key))
+                else:
+                    reused.update(content_hash for content_hash, _ in diagrams)
+                    self.languages.update(language for _, language in diagrams)
+                    reused_files += 1
+            
+            tokenized = list(pool.map(self.tokenize_source, [file for file, _ in changed]))
+        
+        unreadable = {file for (file, _), tokens in zip(changed, tokenized) if tokens is None}
+        changed = [(file, key, tokens) for (file, key), tokens in zip(changed, tokenized) if tokens is not None]
+        if reused_files:
+            print(f"📋 Reusing {reused_files} unchanged file(s) with {len(reused)} diagram(s)")
+        
+        matches = []
+        locations = []
+        for file, _, tokens in changed:
+            relative_path = str(file.relative_to(self.root))
+            for _, match, code_line, _ in tokens:
+                matches.append(match)
+                locations.append((relative_path, code_line + 1))
+                self.languages.add(match[3])
+        
+        image_paths: List[str] = []
+        if matches:
+            print(f"🔄 Processing {len(matches)} diagrams...")
+            
+            if self.validate:
+                self.validate_mermaid_blocks(matches, locations)
+        if matches or reused:
+            # Generate images
             try:
-                # Add file header for reference
-                relative_path = file.relative_to(self.root)
-                full_md += f"\n\n<!-- Source: {relative_path} -->\n\n"
-                
-                # Read and append file content
-                content = file.read_text(encoding='utf-8')
-                full_md += content
-                
-                # Ensure proper spacing between files
-                full_md += "\n\n"
-                
-            except UnicodeDecodeError:
-                print(f"⚠️  Warning: Could not read {file} (encoding issue)")
-                continue
-            except Exception as e:
-                print(f"⚠️  Warning: Error reading {file}: {e}")
+                image_paths = self._generate_mermaid_images(matches, True, reused)
+            except MissingCacheFiles:
+                # Their rows are gone, so the memos and cache hits that relied
+                # on them are stale now and a second pass renders them
+                return self._process_markdown_files(md_files, keys)
+        else:
+            print("ℹ️  No diagrams found")
+        
+        # Hand each changed file its share of the image paths
+        jobs = []
+        offset = 0
+        for file, key, tokens in changed:
+            jobs.append((file, key, tokens, image_paths[offset:offset + len(tokens)]))
+            offset += len(tokens)
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            list(pool.map(lambda job: self.write_processed(*job), jobs))
+        
+        sources = [(file, key) for file, key in zip(md_files, keys) if key is not None and file not in unreadable]
+        self.used_sources = {key for _, key in sources}
+        return sources
+    
+    def stitch_processed_files(self, sources: List[Tuple[Path, str]], destination: Path) -> None:
+        """Stream the processed Markdown of every source file into ``destination``, like ``concatenate_files``."""
+        with open(destination, "w", encoding='utf-8') as combined:
+            for file, key in sources:
+                combined.write(f"\n\n<!-- Source: {file.relative_to(self.root)} -->\n\n")
+                with open(self.processed_dir / f"{key}.md", encoding='utf-8') as processed:
+                    for chunk in iter(lambda: processed.read(CONCAT_CHUNK_SIZE), ""):
+                        combined.write(chunk)
+                combined.write("\n\n")
+    
+    def template_hash(self) -> Optional[str]:
+        if not (self.template_doc and self.template_doc.exists()):
+            return None
+        return hashlib.sha256(self.template_doc.read_bytes()).hexdigest()
+    
+    def build_inputs(self, md_files: List[Path], keys: List[Optional[str]], languages: Set[str]) -> Dict[str, Any]:
+        """Everything the document depends on: sources, template, settings and tool versions."""
+        return {
+            "version": BUILD_MANIFEST_VERSION,
+            "sources": [[str(file.relative_to(self.root)), key] for file, key in zip(md_files, keys) if key],
+            "template": self.template_hash(),
+            "settings": {
+                "output": self.output_doc.name,
+                "diagram_format": self.diagram_format,
+                "render_options": self.render_options,
+                "optimize_png": self.optimize_png,
+                "page_width": self.page_geometry["width"],
+                "markdown_processing": MARKDOWN_PROCESSING_VERSION,
+            },
+            "tools": {
+                "pandoc": tool_version(self.cache_dir, ["pandoc", "--version"]),
+                **{language: self.renderer_version(language) for language in sorted(languages)},
+            },
+        }
+    
+    def describe_changes(self, previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+        """What differs between the inputs of the last build and this one, one reason per line."""
+        reasons = []
+        old_sources = dict(previous["sources"])
+        new_sources = dict(current["sources"])
+        for label, names in (
+            ("added", [name for name in new_sources if name not in old_sources]),
+            ("removed", [name for name in old_sources if name not in new_sources]),
+            ("changed", [name for name in new_sources if name in old_sources and new_sources[name] != old_sources[name]]),
+        ):
+            if names:
+                shown = ", ".join(names[:5]) + (f" and {len(names) - 5} more" if len(names) > 5 else "")
+                reasons.append(f"{len(names)} source file(s) {label}: {shown}")
+        if not reasons and [name for name, _ in previous["sources"]] != [name for name, _ in current["sources"]]:
+            reasons.append("source file order changed")
+        if previous["template"] != current["template"]:
+            reasons.append("template changed")
+        for group in ("settings", "tools"):
+            # New diagram languages already show up as changed sources; new settings do not
+            names = previous[group] if group == "tools" else {**previous[group], **current[group]}
+            for name in names:
+                old, new = previous[group].get(name), current[group].get(name)
+                if isinstance(old, dict) and isinstance(new, dict):
+                    for key in sorted(set(old) | set(new)):
+                        if old.get(key) != new.get(key):
+                            reasons.append(f"{name} {key} changed: {old.get(key)} → {new.get(key)}")
+                elif old != new:
+                    reasons.append(f"{name} changed: {old} → {new}")
+        return reasons
+    
+    def up_to_date(self, md_files: List[Path], keys: List[Optional[str]]) -> bool:
+        """Whether the last build's document is still current, printing why not otherwise."""
+        try:
+            previous = json.loads(self.manifest_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            previous = None
+        if not isinstance(previous, dict) or previous.get("version") != BUILD_MANIFEST_VERSION:
+            print("🔁 Full build: no manifest of an earlier build")
+            return False
+        
+        # Tools of the diagram languages the last build used; new languages show up as source changes
+        current = self.build_inputs(md_files, keys, set(previous["tools"]) - {"pandoc"})
+        reasons = self.describe_changes(previous, current)
+        try:
+            document = os.stat(self.output_doc)
+            if [document.st_size, document.st_mtime_ns] != previous["document"]:
+                reasons.append(f"{self.output_doc.name} was modified since the last build")
+        except OSError:
+            reasons.append(f"{self.output_doc.name} is missing")
+        missing = [name for name in previous["images"] if not (self.img_dir / name).exists()]
+        if missing:
+            reasons.append(f"{len(missing)} image(s) missing from {self.img_dir}")
+        if self.rebuild:
+            reasons.append("--rebuild given")
+        
+        if reasons:
+            print("🔁 Rebuilding:")
+            for reason in reasons:
+                print(f"   - {reason}")
+            return False
+        self.previous_manifest = previous
+        return True
+    
+    def touch_manifest_images(self) -> None:
+        """Mark the diagrams of a build skipped as up to date as used, so eviction keeps them."""
+        keys = {match.group(1) for match in map(DiagramCache.DIAGRAM_PATTERN.match, self.previous_manifest["images"])
+                if match}
+        usage_lock = self.cache.usage_lock()
+        usage_lock.acquire(shared=True)
+        try:
+            self.cache.begin_build()
+            self.cache.touch(keys)
+        finally:
+            usage_lock.release()
+    
+    def write_manifest(self, md_files: List[Path], keys: List[Optional[str]]) -> None:
+        """Record the inputs of a complete build.
+
+        Builds with failed diagrams, or with diagrams the Mermaid CLI drew in
+        place of the selected backend, are not recorded, so they run again.
+        """
+        if self.diagram_failures or self.fallback_renders:
+            self.manifest_file.unlink(missing_ok=True)
+            return
+        manifest = self.build_inputs(md_files, keys, self.languages)
+        document = os.stat(self.output_doc)
+        manifest["document"] = [document.st_size, document.st_mtime_ns]
+        manifest["images"] = sorted(name for content_hash in self.used_images for name in self.artifact_names(content_hash))
+        atomic_write(self.manifest_file, json.dumps(manifest, indent=1).encode('utf-8'))
+    
+    def cleanup_processed_files(self) -> None:
+        """Drop memoized Markdown of source files this build did not use."""
+        for entry in os.scandir(self.processed_dir):
+            if entry.name.split(".")[0] not in self.used_sources:
+                os.unlink(entry.path)
+    
+    def validate_mermaid_blocks(self, matches: List[Tuple[int, int, str, str]], locations: List[Tuple[str, int]]) -> None:
+        """Check every Mermaid diagram before any render starts and report all problems at once.
+
+        Uses the renderer's Mermaid parser when it has one (the browser pool,
+        or the Mermaid CLI's bundled mermaid package) and ``check_mermaid_syntax``
+        otherwise. ``locations`` holds the source file and line of each block's
+        first line of code. Raises RuntimeError after listing the source file
+        and line of each problem the parser found; of the built-in check's
+        findings only the certain ones fail the build, the rest are warnings,
+        since it can be wrong about diagrams Mermaid accepts.
+        """
+        started = time.perf_counter()
+        # Numbered like the diagrams in the rest of the output
+        numbered = [(i, location, code) for i, ((_, _, code, language), location)
+                    in enumerate(zip(matches, locations), start=1) if language == "mermaid"]
+        if not numbered:
+            return
+        codes = [code for _, _, code in numbered]
+        # Line numbers within a block count from its first line of code
+        first_lines = [location for _, location, _ in numbered]
+        
+        try:
+            parser_errors = self.select_renderer().validate(codes)
+        except (OSError, ValueError, RenderError) as e:
+            parser_errors = None
+            print(f"⚠️  The {self.renderer.name} renderer could not validate diagrams ({e}); "
+                  f"using the built-in check")
+        
+        problems = []
+        warnings = []
+        for n, ((i, _, code), (source, first_line)) in enumerate(zip(numbered, first_lines)):
+            if parser_errors is not None:
+                if parser_errors[n]:
+                    message = parser_errors[n].strip()
+                    line = re.search(r'on line (\d+)', message)
+                    offset = int(line.group(1)) - 1 if line else 0
+                    problems.append((source, first_line + offset, i, message.splitlines()[-1]))
+            else:
+                for line, message, certain in check_mermaid_syntax(code):
+                    (problems if certain else warnings).append((source, first_line + line - 1, i, message))
+        
+        for source, line, i, message in warnings:
+            print(f"⚠️  {source}:{line}: diagram {i}: {message}")
+        if problems:
+            for source, line, i, message in problems:
+                print(f"❌ {source}:{line}: diagram {i}: {message}")
+            raise RuntimeError(f"{len(problems)} problem(s) found in Mermaid diagrams; "
+                               f"fix them or pass --no-validate to render anyway")
+        suffix = f", {len(warnings)} possible problem(s)" if warnings else ""
+        print(f"✅ Validated {len(numbered)} Mermaid diagram(s) in {time.perf_counter() - started:.2f}s{suffix}")
+    
+    def select_renderer(self) -> DiagramRenderer:
+        """Pick the rendering backend: the one asked for, or the fastest one available.
+
+        A warm browser pool beats a local Kroki server, which beats starting
+        the Mermaid CLI for every diagram. Remote backends fall back to the
+        Mermaid CLI if they go away mid-build.
+        """
+        if self.renderer is not None:
+            return self.renderer
+        
+        mmdc = MmdcRenderer(self.cache_dir, self.render_timeout)
+        candidates: Dict[str, DiagramRenderer] = {
+            "browser": BrowserPoolRenderer(self.daemon_socket, self.render_timeout, mmdc),
+            "kroki": KrokiRenderer(self.kroki_url or DEFAULT_KROKI_URL, self.render_timeout),
+            "mmdc": mmdc,
+        }
+        if self.renderer_name == "auto":
+            # Only backends the user set up are probed, so a plain build makes no network requests
+            order = [name for name in candidates
+                     if (name != "browser" or self.use_daemon) and (name != "kroki" or self.kroki_url)]
+            # Without any backend the Mermaid CLI is reported missing by validate_dependencies
+            self.renderer = next((candidates[name] for name in order[:-1] if candidates[name].available()), mmdc)
+        else:
+            self.renderer = candidates[self.renderer_name]
+            if not self.renderer.available():
+                hints = {"browser": f"start one with: {Path(sys.argv[0]).name} daemon",
+                         "kroki": f"no Kroki server answers at {self.kroki_url or DEFAULT_KROKI_URL}",
+                         "mmdc": "npm install -g @mermaid-js/mermaid-cli"}
+                raise RuntimeError(f"The {self.renderer_name} renderer is not available; "
+                                   f"{hints[self.renderer_name]}")
+        
+        if self.renderer is not mmdc and mmdc.available():
+            self.fallback_renderer = mmdc
+        print(f"🎨 Diagram renderer: {self.renderer.describe()}")
+        return self.renderer
+    
+    def language_renderer(self, language: str) -> DiagramRenderer:
+        """Renderer of a diagram language: the selected backend for Mermaid, the native tool otherwise."""
+        if language == "mermaid":
+            return self.select_renderer()
+        return self.native_renderers[language]
+    
+    def renderer_version(self, language: str = "mermaid") -> str:
+        """Version of the renderer of ``language``, part of every cache key."""
+        return self.language_renderer(language).version()
+    
+    def diagram_options(self, language: str = "mermaid") -> Dict[str, Any]:
+        """Render options of a language: all of them for Mermaid, the ones the native tools understand otherwise.
+
+        Graphviz and PlantUML lay diagrams out at their natural size, so the
+        page-fitted viewport and theme do not apply to them.
+        """
+        if language == "mermaid":
+            return self.render_options
+        return {"scale": self.render_options["scale"], "backgroundColor": self.render_options["backgroundColor"]}
+    
+    def generate_content_hash(self, content: str, language: str = "mermaid",
+                              renderer_version: Optional[str] = None) -> str:
+        """Generate the cache key of a diagram.
+
+        SHA-256 over the diagram source, every render option and the
+        renderer version (that of the language's renderer unless given), so
+        changing any of them produces a new image. Only line endings and
+        trailing whitespace are normalized; other whitespace can be
+        significant in Mermaid.
+        """
+        normalized = "\n".join(line.rstrip() for line in content.strip().splitlines())
+        key = {
+            "version": CACHE_KEY_VERSION,
+            "source": normalized,
+            "options": self.diagram_options(language),
+            "renderer": renderer_version or self.renderer_version(language),
+        }
+        # Kept out of Mermaid PNG keys so existing caches stay valid
+        if self.diagram_format != "png":
+            key["format"] = self.diagram_format
+        if language != "mermaid":
+            key["language"] = language
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def legacy_content_hash(self, content: str) -> str:
+        """Cache key used before versioned keys: first 8 hex chars of MD5 of the collapsed source."""
+        normalized = re.sub(r'\s+', ' ', content.strip())
+        return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:8]
+    
+    def read_template_geometry(self) -> Dict[str, float]:
+        """Usable page size of the reference document, cached by the template's content hash."""
+        if not (self.template_doc and self.template_doc.exists()):
+            return dict(DEFAULT_PAGE_GEOMETRY)
+        
+        template_hash = hashlib.sha256(self.template_doc.read_bytes()).hexdigest()
+        geometry_file = self.cache_dir / ".page-geometry.json"
+        try:
+            known = json.loads(geometry_file.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            known = {}
+        if template_hash in known:
+            return known[template_hash]
+        
+        try:
+            geometry = read_page_geometry(self.template_doc)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"⚠️  Could not read page size from {self.template_doc} ({e}); assuming the Pandoc default")
+            return dict(DEFAULT_PAGE_GEOMETRY)
+        
+        print(f"📐 Usable page area of {self.template_doc.name}: "
+              f"{geometry['width']:.2f}in x {geometry['height']:.2f}in")
+        known[template_hash] = geometry
+        atomic_write(geometry_file, json.dumps(known).encode('utf-8'))
+        return geometry
+    
+    def diagram_display_width(self, content_hash: str, language: str = "mermaid") -> Optional[float]:
+        """Width in inches a diagram should occupy: its natural size, capped at the usable page width."""
+        entry = self.cache.get(content_hash)
+        width = entry["display_width"] if entry else 0.0
+        if not width:
+            primary = self.cache_dir / self.artifact_names(content_hash)[0]
+            try:
+                css_width = image_css_width(primary)
+            except OSError:
+                css_width = None
+            if not css_width:
+                return None
+            if primary.suffix == ".png" and self.language_renderer(language).applies_scale:
+                css_width /= float(self.render_options["scale"])
+            width = css_width / CSS_PIXELS_PER_INCH
+            if entry:
+                self.cache.set_display_width(content_hash, width)
+        return min(width, self.page_geometry["width"])
+    
+    def image_reference(self, img_path: str) -> str:
+        """Markdown image reference with an explicit width so Word never rescales it."""
+        width = self.image_widths.get(img_path)
+        if width:
+            return f"![]({img_path}){{width={width:.2f}in}}"
+        return f"![]({img_path})"
+    
+    def adopt_existing_diagram(self, code: str, content_hash: str) -> bool:
+        """Adopt an already rendered image for a cache miss instead of re-rendering it.
+
+        Covers images left in the output directory by builds that predate the
+        shared cache, and ``diagram-xxxxxxxx.png`` files from the legacy key
+        layout. Legacy images were always rendered with the default options,
+        so they are only adopted when the current options match those.
+        """
+        if self.shared_cache and all((self.img_dir / name).exists() for name in self.artifact_names(content_hash)):
+            for name in self.artifact_names(content_hash):
+                place_file(self.img_dir / name, self.cache_dir / name)
+            self.record_diagram(content_hash, 0.0)
+            return True
+        
+        if self.diagram_format != "png" or self.render_options != DEFAULT_RENDER_OPTIONS:
+            return False
+        
+        stored = self.cache_dir / f"diagram-{content_hash}.png"
+        legacy_hash = self.legacy_content_hash(code)
+        candidates = [(self.cache_dir / f"diagram-{legacy_hash}.png", legacy_hash)]
+        if self.shared_cache:
+            candidates.append((self.img_dir / f"diagram-{legacy_hash}.png", None))
+        
+        for candidate, legacy_key in candidates:
+            if not candidate.exists():
                 continue
+            if legacy_key:
+                # Legacy entry inside the store itself: rename it to the new key
+                candidate.replace(stored)
+                self.cache.remove(legacy_key)
+            else:
+                place_file(candidate, stored)
+            self.record_diagram(content_hash, 0.0)
+            return True
+        return False
+    
+    def primary_suffix(self) -> str:
+        """Suffix of the image referenced from the document."""
+        return ".png" if self.diagram_format == "png" else ".svg"
+    
+    def artifact_names(self, content_hash: str) -> List[str]:
+        """File names a diagram is stored under; the first one is referenced from the document."""
+        if self.diagram_format == "png":
+            return [f"diagram-{content_hash}.png"]
+        # SVG for the document plus the PNG that Word shows when it cannot render SVG
+        return [f"diagram-{content_hash}.svg", f"diagram-{content_hash}.png"]
+    
+    def move_cached_diagram(self, content_hash: str, new_hash: str) -> None:
+        """Rename the files of a freshly rendered diagram to another cache key."""
+        for name, new_name in zip(self.artifact_names(content_hash), self.artifact_names(new_hash)):
+            os.replace(self.cache_dir / name, self.cache_dir / new_name)
+    
+    def record_diagram(self, content_hash: str, render_seconds: float, language: str = "mermaid") -> None:
+        """Add a diagram whose artifacts are all present in the cache directory to the index."""
+        names = self.artifact_names(content_hash)
+        size = sum((self.cache_dir / name).stat().st_size for name in names)
+        self.cache.record(content_hash, names[0], self.diagram_options(language), size, render_seconds)
+    
+    def optimize_cached_pngs(self, used_hashes: Set[str]) -> None:
+        """Losslessly optimize the cached PNGs of this build that are not optimized yet.
+
+        The optimized file replaces the original under the same cache key, so
+        every image is optimized only once. Uses oxipng or optipng when
+        installed (one process per image, run in threads), otherwise the
+        pure-Python optimizer in worker processes.
+        """
+        todo = sorted(key for key in used_hashes if key in self.cache and not self.cache.get(key)["optimized"])
+        if not todo:
+            return
+        
+        command = find_png_optimizer()
+        optimizer = command[0] if command else "built-in optimizer"
+        print(f"🗜️  Optimizing PNGs of {len(todo)} diagram(s) with {optimizer}...")
+        
+        executor_class = ThreadPoolExecutor if command else ProcessPoolExecutor
+        before_total = after_total = 0
+        with executor_class(max_workers=min(self.jobs, len(todo))) as pool:
+            futures = {}
+            for content_hash in todo:
+                png_file = self.cache_dir / f"diagram-{content_hash}.png"
+                futures[pool.submit(optimize_png_file, str(png_file), command)] = content_hash
+            for future in as_completed(futures):
+                content_hash = futures[future]
+                try:
+                    before, after = future.result()
+                except (OSError, ValueError, zlib.error, subprocess.CalledProcessError) as e:
+                    print(f"⚠️  Could not optimize diagram-{content_hash}.png: {e}")
+                    continue
+                before_total += before
+                after_total += after
+                self.cache.mark_optimized(content_hash, self.cache.get(content_hash)["size"] - before + after)
+        
+        if before_total:
+            saved = before_total - after_total
+            print(f"🗜️  PNG optimization: {format_size(before_total)} → {format_size(after_total)} "
+                  f"({100 * saved / before_total:.0f}% smaller)")
+    
+    def fetch_remote_diagram(self, content_hash: str) -> bool:
+        """Copy a diagram from the remote cache into the local one; False when the remote lacks any artifact."""
+        artifacts = []
+        for name in self.artifact_names(content_hash):
+            data = self.remote.fetch(name)
+            if data is None:
+                self.remote.count("misses")
+                return False
+            artifacts.append((name, data))
+        for name, data in artifacts:
+            atomic_write(self.cache_dir / name, data)
+        self.remote.count("hits")
+        return True
+    
+    def fetch_remote_diagrams(self, pending: Dict[str, Tuple[int, str, str]]) -> Set[str]:
+        """Fetch the pending diagrams the remote cache has, in parallel; returns their hashes."""
+        with ThreadPoolExecutor(max_workers=min(8, len(pending))) as pool:
+            found = pool.map(self.fetch_remote_diagram, pending)
+            return {content_hash for content_hash, ok in zip(pending, found) if ok}
+    
+    def upload_remote_diagrams(self, hashes: Set[str]) -> None:
+        """Store freshly rendered diagrams in the remote cache, in parallel."""
+        def upload(name: str) -> None:
+            try:
+                data = (self.cache_dir / name).read_bytes()
+            except OSError:
+                return
+            if self.remote.store(name, data):
+                self.remote.count("uploads")
+        
+        names = [name for content_hash in hashes for name in self.artifact_names(content_hash)]
+        with ThreadPoolExecutor(max_workers=min(8, len(names))) as pool:
+            list(pool.map(upload, names))
+    
+    def populate_output_images(self, used_hashes: Set[str]) -> None:
+        """Link the diagrams used by this build from the shared cache into the output images directory.
+
+        Only the output directory is looked at, never the cache files, which
+        may sit on a slow network share. Names are content-addressed, but the
+        optimizer rewrites cached images in place, so a diagram whose placed
+        files differ in size from its index entry is placed again. Diagrams
+        whose cache files turn out to be gone are dropped from the index and
+        reported with MissingCacheFiles, so the caller can render them again;
+        without a shared cache the output directory is the cache, and a
+        missing file is reported the same way.
+        """
+        existing = {entry.name: entry.stat().st_size for entry in os.scandir(self.img_dir)}
+        
+        outdated = []
+        missing = set()
+        for content_hash in sorted(used_hashes):
+            placed = [existing.get(name) for name in self.artifact_names(content_hash)]
+            entry = self.cache.get(content_hash)
+            if not self.shared_cache:
+                if None in placed:
+                    missing.add(content_hash)
+            elif None in placed or not entry or sum(placed) != entry["size"]:
+                outdated.append(content_hash)
+        
+        methods: Dict[str, int] = {}
+        for content_hash in outdated:
+            try:
+                for name in self.artifact_names(content_hash):
+                    method = place_file(self.cache_dir / name, self.img_dir / name)
+                    methods[method] = methods.get(method, 0) + 1
+            except FileNotFoundError:
+                missing.add(content_hash)
+        if methods:
+            summary = ", ".join(f"{count} by {method}" for method, count in sorted(methods.items()))
+            print(f"🔗 Placed diagrams from shared cache: {summary}")
+        
+        if missing:
+            for content_hash in sorted(missing):
+                print(f"⚠️  {self.artifact_names(content_hash)[0]} is indexed but missing from the cache; "
+                      f"rendering it again")
+                self.cache.remove(content_hash)
+            raise MissingCacheFiles(missing)
+    
+    def cleanup_output_images(self) -> None:
+        """Remove diagrams this build did not use from the output images directory."""
+        wanted = {name for content_hash in self.used_images for name in self.artifact_names(content_hash)}
+        cleaned_count = 0
+        for entry in os.scandir(self.img_dir):
+            if entry.name not in wanted and DiagramCache.DIAGRAM_PATTERN.match(entry.name):
+                os.unlink(entry.path)
+                cleaned_count += 1
+        if cleaned_count > 0:
+            print(f"🧹 Removed {cleaned_count} unused diagram file(s) from {self.img_dir}")
+    
+    def finish_build(self) -> None:
+        """Tidy the output directory and trim the cache once the document is written.
+
+        Skipped while another build is using the same output directory,
+        since its document may still reference images we would remove.
+        """
+        self.output_lock.release()
+        if not self.output_lock.acquire(timeout=0):
+            print(f"⏭️  {self.output_dir} is in use by another build; skipping cleanup")
+            return
+        try:
+            if self.shared_cache:
+                self.cleanup_output_images()
+            self.cleanup_processed_files()
+            self.evict_cached_diagrams()
+        finally:
+            self.output_lock.release()
+    
+    def evict_cached_diagrams(self) -> None:
+        """Trim the diagram cache according to the size, age and recent-build limits.
+
+        Eviction needs the cache to itself; if any other build is using it
+        the cache is left alone and trimmed by a later build instead.
+        """
+        lock = self.cache.usage_lock()
+        if not lock.acquire(timeout=0):
+            print("⏭️  Diagram cache is in use by another build; skipping eviction")
+            return
+        try:
+            self.cache.reload()
+            evicted = self.cache.evict(self.cache_max_bytes, self.cache_max_age, self.cache_keep_builds)
+        finally:
+            lock.release()
+        
+        for entry in evicted:
+            print(f"🗑️  Evicted cached diagram: {entry['filename']}")
+        
+        if evicted:
+            freed = sum(entry["size"] for entry in evicted)
+            print(f"🧹 Evicted {len(evicted)} cached diagram(s), freed {format_size(freed)}; "
+                  f"cache now {format_size(self.cache.total_bytes())}")
+    
+    def fallback_options(self, language: str = "mermaid") -> Dict[str, Any]:
+        """Render options of the PNG stored next to each SVG."""
+        if self.diagram_format == "svg":
+            # Only shown by Word versions without SVG support, so keep it small
+            return dict(self.diagram_options(language), scale=1)
+        return self.diagram_options(language)
+    
+    def render_with_fallback(self, code: str, output_format: str, options: Dict[str, Any], destination: Path,
+                             language: str = "mermaid", content_hash: Optional[str] = None) -> None:
+        """Render with the language's renderer, or with the Mermaid CLI if a Mermaid backend cannot be reached.
+
+        ``content_hash`` is noted in ``fallback_renders`` when the Mermaid CLI
+        stands in, so the image can be keyed by the renderer that drew it.
+        """
+        if language != "mermaid":
+            self.native_renderers[language].render(code, output_format, options, destination)
+            return
+        try:
+            self.renderer.render(code, output_format, options, destination)
+        except RenderError:
+            raise
+        except OSError as e:
+            if self.fallback_renderer is None:
+                raise
+            print(f"⚠️  The {self.renderer.name} renderer is unavailable ({e}), falling back to mmdc")
+            if content_hash:
+                with self.render_events_lock:
+                    self.fallback_renders.add(content_hash)
+            self.fallback_renderer.render(code, output_format, options, destination)
+    
+    def render_fallback_png(self, code: str, content_hash: str, language: str = "mermaid") -> None:
+        """Produce the PNG stored next to a rendered SVG.
+
+        Converting the SVG with ``rsvg-convert`` avoids another trip through
+        a browser; without it the PNG comes from the renderer.
+        """
+        svg_file = self.cache_dir / f"diagram-{content_hash}.svg"
+        png_file = self.cache_dir / f"diagram-{content_hash}.png"
+        options = self.fallback_options(language)
+        
+        if shutil.which("rsvg-convert"):
+            output_file = temporary_path(png_file)
+            try:
+                run_renderer(
+                    ["rsvg-convert", "--zoom", str(options["scale"]), "--background-color", options["backgroundColor"],
+                     "-o", str(output_file), str(svg_file)],
+                    self.render_timeout
+                )
+                os.replace(output_file, png_file)
+                return
+            except (OSError, subprocess.CalledProcessError, RenderTimeout):
+                pass
+            finally:
+                if output_file.exists():
+                    output_file.unlink()
+        
+        self.render_with_fallback(code, "png", options, png_file, language, content_hash)
+    
+    def render_diagram(self, code: str, content_hash: str, index: int = 0,
+                       language: str = "mermaid") -> Tuple[bool, str, float, bool]:
+        """Render a single diagram with the renderer of its language.
+
+        Returns (success, error message, render seconds, whether a failure
+        lies in the diagram itself and would recur on every attempt). Safe to call from
+        worker threads and concurrent builds: the per-key lock makes other
+        processes wait for this render instead of duplicating it, and the
+        image is written under a unique temporary name and renamed into place.
+        Timeouts and renderer crashes are retried with exponential backoff;
+        errors in the diagram itself are not.
+        """
+        started = time.perf_counter()
+        
+        lock = FileLock(self.cache.lock_path(content_hash))
+        if not lock.acquire(timeout=LOCK_TIMEOUT):
+            return False, "Timed out waiting for another build rendering this diagram", time.perf_counter() - started, False
+        try:
+            if all((self.cache_dir / name).exists() for name in self.artifact_names(content_hash)):
+                # Another build rendered it while we were waiting
+                return True, "", time.perf_counter() - started, False
+            
+            attempts = self.render_retries + 1
+            for attempt in range(1, attempts + 1):
+                try:
+                    self.render_artifacts(code, content_hash, language)
+                    return True, "", time.perf_counter() - started, False
+                except (RenderError, OSError) as e:
+                    error = e
+                if isinstance(error, RenderTimeout):
+                    self.count_render_event("timeouts")
+                    print(f"⏱️  Diagram {index}: {error}")
+                if attempt == attempts or not is_transient_render_error(error):
+                    break
+                
+                delay = RENDER_RETRY_BACKOFF * 2 ** (attempt - 1)
+                self.count_render_event("retries")
+                print(f"🔁 Retrying diagram {index} in {delay:g}s (attempt {attempt + 1} of {attempts})")
+                time.sleep(delay)
+            
+            # Missing tools and other OS errors say nothing about the diagram
+            permanent = isinstance(error, RenderError) and not error.transient
+            return False, str(error), time.perf_counter() - started, permanent
+        finally:
+            lock.release()
+    
+    def render_artifacts(self, code: str, content_hash: str, language: str = "mermaid") -> None:
+        """One render attempt: the primary image and, for SVG, its PNG fallback."""
+        primary_file = self.cache_dir / self.artifact_names(content_hash)[0]
+        primary_format = primary_file.suffix[1:]
         
-        return full_md
+        # The primary image may already exist when a batch or an earlier attempt rendered it
+        if not primary_file.exists():
+            self.render_with_fallback(code, primary_format, self.diagram_options(language), primary_file,
+                                      language, content_hash)
+        if primary_format == "svg":
+            self.render_fallback_png(code, content_hash, language)
+    
+    def count_render_event(self, event: str) -> None:
+        with self.render_events_lock:
+            self.render_events[event] += 1
     
-    def extract_mermaid_blocks(self, md_text: str) -> List[Tuple[int, int, str]]:
-        """Extract Mermaid code blocks and return (start, end, code) tuples."""
-        pattern = r"```mermaid\s*\n([\s\S]+?)\n```"
-        matches = []
+    def render_batch(self, pending: Dict[str, Tuple[int, str, str]]) -> Dict[str, float]:
+        """Render every pending diagram with a single Mermaid CLI process.
+
+        All blocks are written to one Markdown file, so Node, Puppeteer and
+        Chromium start once for the whole build. mmdc names the outputs
+        ``<output>-1.png``, ``<output>-2.png``... in block order, which maps
+        each image back to its content hash. Returns the hashes that were
+        rendered with their share of the batch time; anything missing (for
+        example because one bad block aborted the batch, or because another
+        build holds its render lock) is left for the caller to render
+        individually. Diagrams with a line mmdc could read as a fence are
+        never batched, and if the images do not match the blocks one to one
+        the whole batch is discarded rather than cached under the wrong key.
+        """
+        # Only batch diagrams no other build is rendering right now
+        locks = {}
+        for content_hash in pending:
+            lock = FileLock(self.cache.lock_path(content_hash))
+            if lock.acquire(timeout=0):
+                locks[content_hash] = lock
+        primary_suffix = self.primary_suffix()
+        hashes = [content_hash for content_hash in pending
+                  if content_hash in locks
+                  and not BATCH_UNSAFE_LINE.search(pending[content_hash][1])
+                  and not (self.cache_dir / f"diagram-{content_hash}{primary_suffix}").exists()]
         
-        for match in re.finditer(pattern, md_text):
-            start, end = match.span()
-            code = match.group(1).strip()
-            matches.append((start, end, code))
+        batch_dir = Path(tempfile.mkdtemp(prefix=".batch-", dir=self.cache_dir))
+        batch_input = batch_dir / "diagrams.md"
+        batch_output = batch_dir / "rendered.md"
+        started = time.perf_counter()
         
-        return matches
-    
-    def generate_content_hash(self, content: str) -> str:
-        """Generate MD5 hash from mermaid code content."""
-        # Normalize content (remove extra whitespace, ensure consistent line endings)
-        normalized = re.sub(r'\s+', ' ', content.strip())
-        return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:8]  # Use first 8 chars
+        try:
+            if not hashes:
+                return {}
+            blocks = [f"```mermaid\n{pending[content_hash][1]}\n```\n" for content_hash in hashes]
+            batch_input.write_text("\n".join(blocks), encoding='utf-8')
+            timed_out = False
+            
+            try:
+                # The time limit applies per diagram: the batch is only killed
+                # once no new image has appeared for that long
+                run_renderer(
+                    ["mmdc", "-i", str(batch_input), "-o", str(batch_output), "--outputFormat", primary_suffix[1:]]
+                    + self.renderer.options(self.render_options, svg=primary_suffix == ".svg"),
+                    self.render_timeout,
+                    progress=lambda: sum(1 for _ in batch_dir.glob(f"rendered-*{primary_suffix}"))
+                )
+            except RenderTimeout as e:
+                # Images written before the stall are complete; keep them
+                self.count_render_event("timeouts")
+                timed_out = True
+                print(f"⏱️  Batch render: {e}; retrying the rest individually")
+            except subprocess.CalledProcessError as e:
+                print(f"⚠️  Batch render failed, retrying diagrams individually: {(e.stderr or str(e)).strip()}")
+                return {}
+            except OSError as e:
+                print(f"⚠️  Batch render failed, retrying diagrams individually: {e}")
+                return {}
+            
+            # A positional match is only trustworthy with one image per block:
+            # outputs 1..k for a prefix of the blocks and nothing beyond them
+            # (a complete run must have produced an image for every block)
+            names = {output.name for output in batch_dir.glob(f"rendered-*{primary_suffix}")}
+            expected = len(names) if timed_out else len(hashes)
+            if names != {f"rendered-{n}{primary_suffix}" for n in range(1, expected + 1)} or expected > len(hashes):
+                print(f"⚠️  Batch render produced {len(names)} image(s) for {len(hashes)} diagram(s); "
+                      f"rendering them individually")
+                return {}
+            
+            rendered = []
+            for n, content_hash in enumerate(hashes, start=1):
+                output = batch_dir / f"rendered-{n}{primary_suffix}"
+                if output.exists():
+                    output.replace(self.cache_dir / f"diagram-{content_hash}{primary_suffix}")
+                    rendered.append(content_hash)
+            
+            share = (time.perf_counter() - started) / max(1, len(rendered))
+            return {content_hash: share for content_hash in rendered}
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            for lock in locks.values():
+                lock.release()
     
-    def cleanup_unused_diagrams(self, used_hashes: Set[str]) -> None:
-        """Remove diagram files that are no longer needed."""
-        if not self.img_dir.exists():
+    def render_pending(self, pending: Dict[str, Tuple[int, str, str]]) -> Iterator[Tuple[str, bool, str, float, bool]]:
+        """Render cache misses, yielding (hash, success, error, seconds, permanent) as each finishes.
+
+        In batch mode everything is first attempted in one renderer process;
+        diagrams the batch did not produce fall through to the worker pool so
+        their errors are reported against the right block. Closing the
+        generator cancels the renders that have not started yet.
+        """
+        remaining = dict(pending)
+        
+        # Only the Mermaid CLI pays the browser startup cost batching is meant to save
+        mermaid = {content_hash: entry for content_hash, entry in remaining.items() if entry[2] == "mermaid"}
+        if self.batch and isinstance(self.select_renderer(), MmdcRenderer) and len(mermaid) > 1:
+            print(f"⚙️  Rendering {len(mermaid)} Mermaid diagram(s) in a single batch...")
+            for content_hash, seconds in self.render_batch(mermaid).items():
+                if self.diagram_format == "png":
+                    del remaining[content_hash]
+                    yield content_hash, True, "", seconds, False
+                # Batched SVGs still need their fallback PNG from the worker pool below
+        
+        if not remaining:
             return
-            
-        existing_diagrams = list(self.img_dir.glob("diagram-*.png"))
-        cleaned_count = 0
         
-        for diagram_file in existing_diagrams:
-            # Extract hash from filename (diagram-a1b2c3d4.png -> a1b2c3d4)
-            match = re.match(r'diagram-([a-f0-9]{8})\.png', diagram_file.name)
-            if match:
-                file_hash = match.group(1)
-                if file_hash not in used_hashes:
-                    diagram_file.unlink()
-                    cleaned_count += 1
-                    print(f"🗑️  Removed unused diagram: {diagram_file.name}")
+        workers = min(self.jobs, len(remaining))
+        self.concurrency = AdaptiveConcurrency(workers, self.adaptive_jobs)
+        mode = "up to " if self.adaptive_jobs and workers > 1 else ""
+        print(f"⚙️  Rendering {len(remaining)} diagram(s) with {mode}{workers} worker(s), "
+              f"{self.concurrency.limit} to start...")
         
-        if cleaned_count > 0:
-            print(f"🧹 Cleaned up {cleaned_count} unused diagram file(s)")
+        def render(code: str, content_hash: str, index: int, language: str) -> Tuple[bool, str, float, bool]:
+            if not self.concurrency.acquire():
+                return False, "Cancelled", 0.0, False
+            try:
+                return self.render_diagram(code, content_hash, index, language)
+            finally:
+                self.concurrency.release()
+        
+        with self.concurrency, ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(render, code, content_hash, index, language): content_hash
+                for content_hash, (index, code, language) in remaining.items()
+            }
+            try:
+                for future in as_completed(futures):
+                    yield (futures[future],) + future.result()
+            finally:
+                # Closed early (failure budget exhausted): drop renders not yet started
+                for future in futures:
+                    future.cancel()
+                self.concurrency.close()
     
-    def generate_mermaid_images(self, matches: List[Tuple[int, int, str]]) -> List[str]:
-        """Generate PNG images from Mermaid code blocks with hash-based caching."""
-        image_paths = []
-        used_hashes = set()
-        generated_count = 0
+    def generate_mermaid_images(self, matches: List[Tuple[int, int, str, str]], link_images: bool = True,
+                                reused: Set[str] = frozenset()) -> List[str]:
+        """Generate PNG (or SVG, see ``diagram_format``) images from diagram code blocks with hash-based caching.
+        
+        Uncached diagrams are rendered concurrently by up to ``self.jobs``
+        workers (or in one batch process, see ``render_batch``); the returned
+        paths are always in the original match order. With ``link_images``
+        off the images only go into the cache, not the output directory.
+        ``reused`` are cached diagrams of unchanged source files, which are
+        linked into the output directory without being looked at again.
+        Raises MissingCacheFiles when indexed files have disappeared.
+        """
+        # Hold the cache in shared use until the images are linked into the
+        # output directory, so no other build evicts them underneath us
+        usage_lock = self.cache.usage_lock()
+        usage_lock.acquire(shared=True)
+        try:
+            return self._generate_mermaid_images(matches, link_images, reused)
+        finally:
+            usage_lock.release()
+    
+    def _generate_mermaid_images(self, matches: List[Tuple[int, int, str, str]], link_images: bool,
+                                 reused: Set[str]) -> List[str]:
+        used_hashes = set(reused)
         cached_count = 0
+        self.cache.reload()
+        self.cache.begin_build()
         
-        for i, (_, _, code) in enumerate(matches, start=1):
+        # First pass: resolve cache hits and collect the unique diagrams to render
+        hashes = []
+        pending: Dict[str, Tuple[int, str, str]] = {}
+        failures: Dict[str, str] = {}
+        known_failures = 0
+        languages: Dict[str, str] = {}
+        for i, (_, _, code, language) in enumerate(matches, start=1):
             # Generate hash from code content
-            content_hash = self.generate_content_hash(code)
+            content_hash = self.generate_content_hash(code, language)
+            languages[content_hash] = language
             used_hashes.add(content_hash)
+            hashes.append(content_hash)
             
-            # Use hash-based filename
-            mmd_file = self.img_dir / f"diagram-{content_hash}.mmd"
-            png_file = self.img_dir / f"diagram-{content_hash}.png"
-            
-            # Check if image already exists
-            if png_file.exists():
+            image_name = self.artifact_names(content_hash)[0]
+            if content_hash in pending or content_hash in failures:
+                continue
+            # The index is trusted: a file deleted behind its back is caught
+            # when the image is linked (see populate_output_images)
+            if content_hash in self.cache:
                 cached_count += 1
-                print(f"📋 Using cached diagram {i}: {png_file.name}")
+                print(f"📋 Using cached diagram {i}: {image_name}")
+            elif language == "mermaid" and self.adopt_existing_diagram(code, content_hash):
+                cached_count += 1
+                print(f"📋 Using cached diagram {i}: {image_name} (adopted from an earlier build)")
+            elif content_hash in self.cache.failures and not self.retry_failed:
+                # Same source and options as a render that already failed
+                failures[content_hash] = self.cache.failures[content_hash]["error"]
+                known_failures += 1
+                print(f"🚫 Skipping diagram {i}, which failed in an earlier build (use --retry-failed to retry): "
+                      f"{failures[content_hash].strip()}")
             else:
-                # Generate new image
-                try:
-                    # Write Mermaid code to temp file
-                    mmd_file.write_text(code, encoding='utf-8')
-                    
-                    # Generate PNG using Mermaid CLI with higher resolution
-                    result = subprocess.run([
-                        "mmdc", 
-                        "-i", str(mmd_file), 
-                        "-o", str(png_file),
-                        "--theme", "default",
-                        "--backgroundColor", "white",
-                        "--scale", "2",           # 2x resolution for crisp images
-                        "--width", "1200",        # Wider viewport for better diagram layout
-                        "--height", "800"         # Taller viewport for complex diagrams
-                    ], capture_output=True, text=True, shell=True, check=True)
-                    
-                    # Clean up temp file
-                    mmd_file.unlink()
-                    
-                    generated_count += 1
-                    print(f"🖼️  Generated diagram {i}: {png_file.name}")
-                    
-                except subprocess.CalledProcessError as e:
-                    print(f"❌ Failed to generate diagram {i}: {e.stderr}")
-                    # Use placeholder text instead
-                    image_paths.append(f"[Diagram {i} - Generation Failed]")
-                    continue
-            
-            # Use relative path for markdown
-            relative_img_path = f"images/diagram-{content_hash}.png"
-            image_paths.append(relative_img_path)
+                pending[content_hash] = (i, code, language)
         
-        # Clean up unused diagram files
-        self.cleanup_unused_diagrams(used_hashes)
-        
-        # Summary
-        if generated_count > 0 or cached_count > 0:
-            print(f"📊 Diagram summary: {generated_count} generated, {cached_count} cached")
-        
-        return image_paths
-    
-    def replace_mermaid_blocks(self, md_text: str) -> str:
-        """Replace Mermaid code blocks with image references."""
-        matches = self.extract_mermaid_blocks(md_text)
+        # Diagrams another machine already rendered come from the remote cache
+        remote_count = 0
+        if self.remote and pending:
+            for content_hash in sorted(self.fetch_remote_diagrams(pending), key=lambda h: pending[h][0]):
+                i = pending.pop(content_hash)[0]
+                self.record_diagram(content_hash, 0.0, languages[content_hash])
+                cached_count += 1
+                remote_count += 1
+                print(f"🌐 Using remote cached diagram {i}: {self.artifact_names(content_hash)[0]}")
         
-        if not matches:
-            print("ℹ️  No Mermaid diagrams found")
-            return md_text
+        # Second pass: render cache misses
+        render_seconds = 0.0
+        slowest: Tuple[float, int] = (0.0, 0)
+        wall_started = time.perf_counter()
+        rekeyed: Dict[str, str] = {}
+        renders = self.render_pending(pending)
+        for content_hash, ok, error, seconds, permanent in renders:
+            i, code, language = pending[content_hash]
+            render_seconds += seconds
+            slowest = max(slowest, (seconds, i))
+            # Drawn by the Mermaid CLI because the selected backend went away
+            fallback_hash = None
+            if content_hash in self.fallback_renders:
+                fallback_hash = self.generate_content_hash(code, language, self.fallback_renderer.version())
+            if ok:
+                if fallback_hash:
+                    self.move_cached_diagram(content_hash, fallback_hash)
+                    rekeyed[content_hash] = fallback_hash
+                    languages[fallback_hash] = language
+                self.record_diagram(fallback_hash or content_hash, seconds, language)
+                print(f"🖼️  Generated diagram {i}: {self.artifact_names(fallback_hash or content_hash)[0]} ({seconds:.1f}s)")
+            else:
+                failures[content_hash] = error
+                if permanent:
+                    self.cache.record_failure(fallback_hash or content_hash, error)
+                print(f"❌ Failed to generate diagram {i}: {error}")
+                if self.max_failures is not None and len(failures) - known_failures > self.max_failures:
+                    renders.close()
+                    raise RuntimeError(f"{len(failures)} diagram(s) failed to render, more than the "
+                                       f"--max-failures budget of {self.max_failures}; build aborted")
+        wall_seconds = time.perf_counter() - wall_started
+        if rekeyed:
+            hashes = [rekeyed.get(content_hash, content_hash) for content_hash in hashes]
+            used_hashes = used_hashes.difference(rekeyed) | set(rekeyed.values())
         
-        print(f"🔄 Processing {len(matches)} Mermaid diagrams...")
+        # Build image paths in the original order
+        image_paths = []
+        for i, content_hash in enumerate(hashes, start=1):
+            if content_hash in failures:
+                # Use placeholder text instead
+                image_paths.append(f"[Diagram {i} - Generation Failed]")
+            else:
+                # Use relative path for markdown
+                img_path = f"images/{self.artifact_names(content_hash)[0]}"
+                image_paths.append(img_path)
+                if img_path not in self.image_widths:
+                    width = self.diagram_display_width(content_hash, languages[content_hash])
+                    if width:
+                        self.image_widths[img_path] = width
         
-        # Generate images
-        image_paths = self.generate_mermaid_images(matches)
+        # Record usage and bring the output images directory up to date
+        self.cache.touch(used_hashes)
+        self.used_images = used_hashes - set(failures)
+        self.diagram_failures = len(failures)
+        if self.optimize_png:
+            self.optimize_cached_pngs(self.used_images)
+        generated = {rekeyed.get(content_hash, content_hash) for content_hash in pending if content_hash not in failures}
+        uploaded_before = self.remote.counters["uploads"] if self.remote else 0
+        if self.remote and generated and not self.remote.read_only:
+            self.upload_remote_diagrams(generated)
+        if link_images:
+            self.populate_output_images(self.used_images)
         
-        # Replace blocks working backwards to preserve positions
-        result = md_text
-        for i, ((start, end, _), img_path) in enumerate(zip(reversed(matches), reversed(image_paths))):
-            diagram_num = len(matches) - i
-            
-            if img_path.startswith("["):
-                # Failed generation - use placeholder
-                replacement = f"\n{img_path}\n"
-            else:
-                # No caption - just the image
-                replacement = f"\n![]({img_path})\n"
-            
-            result = result[:start] + replacement + result[end:]
+        # Summary
+        generated_count = len(pending) - (len(failures) - known_failures)
+        if pending or cached_count > 0 or known_failures:
+            skipped = f" ({known_failures} known failure(s) skipped)" if known_failures else ""
+            print(f"📊 Diagram summary: {generated_count} generated, {cached_count} cached, "
+                  f"{len(failures)} failed{skipped}")
+        if pending:
+            print(f"⏱️  Render time: {wall_seconds:.1f}s wall clock, {render_seconds:.1f}s summed across workers, "
+                  f"slowest diagram {slowest[1]} ({slowest[0]:.1f}s)")
+        if self.concurrency:
+            print(f"⚙️  Concurrency: {self.concurrency.summary()}")
+            self.concurrency = None
+        uploaded = self.remote.counters["uploads"] - uploaded_before if self.remote else 0
+        if remote_count or uploaded:
+            print(f"🌐 Remote cache: {remote_count} hit(s), {uploaded} artifact(s) uploaded")
+        if any(self.render_events.values()):
+            print(f"⚠️  Renderer trouble: {self.render_events['timeouts']} timeout(s) killed, "
+                  f"{self.render_events['retries']} retry(ies)")
         
-        return result
+        return image_paths
     
-    def generate_word_document(self, md_content: str) -> None:
-        """Generate Word document using Pandoc."""
-        # Save processed combined markdown (with image references)
-        self.temp_md.write_text(md_content, encoding='utf-8')
-        print(f"📝 Saved processed combined markdown: {self.temp_md}")
-        
+    def generate_word_document(self) -> None:
+        """Generate Word document from the processed combined Markdown using Pandoc."""
         # Build Pandoc command with relative paths from build directory
         output_filename = self.output_doc.name  # Get just the filename part
         cmd = [
@@ -311,7 +3627,7 @@ class DocumentationGenerator:
             os.chdir(self.output_dir)  # Change to build directory
             print(f"🔄 Running Pandoc from: {self.output_dir}")
             
-            result = subprocess.run(cmd, capture_output=True, text=True, shell=True, check=True)
+            result = subprocess.run(cmd, capture_output=True, text=True, shell=USE_SHELL, check=True)
             print(f"✅ Generated Word document: {self.output_doc}")
             
         except subprocess.CalledProcessError as e:
@@ -319,6 +3635,86 @@ class DocumentationGenerator:
             raise
         finally:
             os.chdir(original_cwd)  # Always restore original directory
+        
+        if self.diagram_format != "png":
+            self.add_svg_fallbacks()
+    
+    def add_svg_fallbacks(self) -> None:
+        """Give every embedded SVG diagram a PNG fallback inside the Word document.
+
+        Word 2016 and later draw the SVG referenced by an ``asvg:svgBlip``
+        extension; older versions and other readers show the PNG that the
+        ``a:blip`` itself points to. Pandoc may embed only the SVG, so the
+        PNG parts and relationships are added here. Images Pandoc already
+        gave a fallback are left untouched.
+        """
+        fallbacks = {}
+        for content_hash in self.used_images:
+            svg_file = self.img_dir / f"diagram-{content_hash}.svg"
+            fallbacks[hashlib.sha256(svg_file.read_bytes()).hexdigest()] = self.img_dir / f"diagram-{content_hash}.png"
+        
+        with zipfile.ZipFile(self.output_doc) as docx:
+            infos = docx.infolist()
+            parts = {info.filename: docx.read(info) for info in infos}
+        
+        rels_name = "word/_rels/document.xml.rels"
+        rels = parts[rels_name].decode('utf-8')
+        document = parts["word/document.xml"].decode('utf-8')
+        new_parts: Dict[str, bytes] = {}
+        new_rels = []
+        
+        for element in re.findall(r'<Relationship\b[^>]*/>', rels):
+            attributes = dict(re.findall(r'(\w+)="([^"]*)"', element))
+            target = attributes.get("Target", "")
+            if not target.endswith(".svg"):
+                continue
+            png_file = fallbacks.get(hashlib.sha256(parts.get(f"word/{target}", b"")).hexdigest())
+            if png_file is None:
+                continue
+            
+            svg_id = attributes["Id"]
+            png_id = f"{svg_id}Fallback"
+            blip = re.compile(rf'<a:blip r:embed="{re.escape(svg_id)}"\s*/>')
+            replacement = (
+                f'<a:blip r:embed="{png_id}"><a:extLst><a:ext uri="{SVG_BLIP_EXTENSION_URI}">'
+                f'<asvg:svgBlip xmlns:asvg="http://schemas.microsoft.com/office/drawing/2016/SVG/main" '
+                f'r:embed="{svg_id}"/></a:ext></a:extLst></a:blip>'
+            )
+            document, count = blip.subn(replacement, document)
+            if count:
+                png_target = target[:-len(".svg")] + "-fallback.png"
+                new_parts[f"word/{png_target}"] = png_file.read_bytes()
+                new_rels.append(
+                    f'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+                    f'Id="{png_id}" Target="{png_target}"/>'
+                )
+        
+        if not new_parts:
+            return
+        
+        parts["word/document.xml"] = document.encode('utf-8')
+        parts[rels_name] = rels.replace("</Relationships>", "".join(new_rels) + "</Relationships>").encode('utf-8')
+        content_types = parts["[Content_Types].xml"].decode('utf-8')
+        for extension, content_type in (("png", "image/png"), ("svg", "image/svg+xml")):
+            if f'Extension="{extension}"' not in content_types:
+                content_types = content_types.replace(
+                    "</Types>", f'<Default Extension="{extension}" ContentType="{content_type}"/></Types>'
+                )
+        parts["[Content_Types].xml"] = content_types.encode('utf-8')
+        
+        temporary = temporary_path(self.output_doc)
+        try:
+            with zipfile.ZipFile(temporary, "w", zipfile.ZIP_DEFLATED) as docx:
+                for info in infos:
+                    docx.writestr(info, parts[info.filename])
+                for name, data in new_parts.items():
+                    # PNG data is already compressed
+                    docx.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+            os.replace(temporary, self.output_doc)
+        finally:
+            if temporary.exists():
+                temporary.unlink()
+        print(f"🖼️  Added PNG fallbacks for {len(new_parts)} SVG diagram(s)")
     
     def generate(self) -> None:
         """Main generation process."""
@@ -328,46 +3724,500 @@ class DocumentationGenerator:
         self.validate_dependencies()
         print()
         
+        # Ensure directories exist
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.img_dir.mkdir(parents=True, exist_ok=True)
+        self.processed_dir.mkdir(exist_ok=True)
+        
+        # Mark the output directory as in use until the document is written
+        self.output_lock.acquire(shared=True)
+        try:
+            self._generate()
+        finally:
+            self.output_lock.release()
+            self.close_renderers()
+    
+    def warm_cache(self) -> None:
+        """Render every diagram of the tree into the cache without building a document.
+
+        Nothing is concatenated, no Markdown is written and Pandoc does not
+        run, so CI can fill the cache in an early job and the document
+        builds that follow are pure cache hits.
+        """
+        print("🔥 Warming the diagram cache...\n")
+        self.validate_dependencies(need_pandoc=False)
+        print()
+        
+        try:
+            matches = []
+            for file in self.collect_markdown_files():
+                try:
+                    with open(file, encoding='utf-8') as lines:
+                        matches.extend(self.extract_diagram_blocks(lines))
+                except (OSError, UnicodeDecodeError) as e:
+                    print(f"⚠️  Warning: Error reading {file}: {e}")
+            print()
+            
+            if not matches:
+                print("ℹ️  No diagrams found")
+                return
+            print(f"🔄 Processing {len(matches)} diagrams...")
+            self.generate_mermaid_images(matches, link_images=False)
+            self.evict_cached_diagrams()
+        finally:
+            self.close_renderers()
+        
+        print(f"\n🎉 Diagram cache warmed: {self.cache_dir} "
+              f"({len(self.cache)} diagrams, {format_size(self.cache.total_bytes())})")
+    
+    def close_renderers(self) -> None:
+        for renderer in [self.renderer] + list(self.native_renderers.values()):
+            if renderer is not None:
+                renderer.close()
+    
+    def _generate(self) -> None:
         # Collect files
         md_files = self.collect_markdown_files()
         print()
         
-        # Concatenate content
-        print("🔗 Concatenating files...")
-        full_md = self.concatenate_files(md_files)
+        # Nothing to do when no input changed since the last build
+        keys = self.hash_sources(md_files)
+        if self.up_to_date(md_files, keys):
+            self.touch_manifest_images()
+            print(f"✅ Nothing changed since the last build; {self.output_doc} is up to date")
+            return
         
-        # Save original combined markdown (with mermaid codeblocks intact)
-        self.temp_md_original.write_text(full_md, encoding='utf-8')
+        # Process Mermaid diagrams file by file
+        sources = self.process_markdown_files(md_files, keys)
+        
+        # Concatenate content into the original combined markdown (with mermaid codeblocks intact)
+        print("🔗 Concatenating files...")
+        self.concatenate_files([file for file, _ in sources], self.temp_md_original)
         print(f"📝 Saved original combined markdown: {self.temp_md_original}")
         
-        # Process Mermaid diagrams
-        processed_md = self.replace_mermaid_blocks(full_md)
+        # ... and the processed one (with image references)
+        self.stitch_processed_files(sources, self.temp_md)
+        print(f"📝 Saved processed combined markdown: {self.temp_md}")
         print()
         
         # Generate Word document
         print("📄 Generating Word document...")
-        self.generate_word_document(processed_md)
+        self.generate_word_document()
+        self.write_manifest(md_files, keys)
+        self.finish_build()
         
         print(f"\n🎉 Documentation generated successfully!")
         print(f"📂 Output directory: {self.output_dir.absolute()}")
         print(f"📄 Word document: {self.output_doc.absolute()}")
         print(f"📝 Original markdown: {self.temp_md_original.absolute()}")
         print(f"📝 Processed markdown: {self.temp_md.absolute()}")
-        if self.img_dir.exists() and list(self.img_dir.glob("*.png")):
+        if self.used_images:
             print(f"🖼️  Images: {self.img_dir.absolute()}")
 
 
+# Page loaded once per browser tab; the Mermaid runtime is injected afterwards.
+DAEMON_PAGE_HTML = "<!DOCTYPE html><html><body style='margin:0'><div id='container'></div></body></html>"
+
+DAEMON_RENDER_JS = """
+async ([code, theme, background, htmlLabels]) => {
+    mermaid.initialize({startOnLoad: false, theme: theme, htmlLabels: htmlLabels, flowchart: {htmlLabels: htmlLabels}});
+    document.body.style.background = background;
+    const container = document.getElementById("container");
+    container.innerHTML = "";
+    const { svg } = await mermaid.render("diagram" + Date.now(), code);
+    container.innerHTML = svg;
+    return svg;
+}
+"""
+
+
+DAEMON_VALIDATE_JS = """
+async (codes) => {
+    mermaid.initialize({startOnLoad: false});
+    const errors = [];
+    for (const code of codes) {
+        try {
+            await mermaid.parse(code);
+            errors.push(null);
+        } catch (e) {
+            errors.push(String((e && e.message) || e));
+        }
+    }
+    return errors;
+}
+"""
+
+
+# Node script behind MmdcRenderer.validate, preceded by ``const validate = DAEMON_VALIDATE_JS``.
+# Arguments: the Mermaid CLI's mermaid.min.js and a JSON file with the diagrams.
+MMDC_VALIDATE_JS = """
+const fs = require("fs");
+const path = require("path");
+const [mermaidJs, codesFile] = process.argv.slice(2);
+// Puppeteer is a dependency of the Mermaid CLI, installed next to its mermaid package
+const puppeteer = require(require.resolve("puppeteer", {paths: [path.dirname(mermaidJs)]}));
+(async () => {
+    const browser = await puppeteer.launch({headless: true});
+    try {
+        const page = await browser.newPage();
+        await page.addScriptTag({path: mermaidJs});
+        const codes = JSON.parse(fs.readFileSync(codesFile, "utf8"));
+        process.stdout.write(JSON.stringify(await page.evaluate(validate, codes)));
+    } finally {
+        await browser.close();
+    }
+})().catch((e) => {
+    process.stderr.write(String((e && e.stack) || e) + "\\n");
+    process.exit(1);
+});
+"""
+
+
+def find_mermaid_js() -> Optional[Path]:
+    """Locate the mermaid.min.js bundled with a global Mermaid CLI install."""
+    try:
+        npm_root = subprocess.run(
+            ["npm", "root", "-g"], capture_output=True, text=True, shell=USE_SHELL, check=True, timeout=30
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+    
+    candidates = [
+        Path(npm_root) / "@mermaid-js" / "mermaid-cli" / "node_modules" / "mermaid" / "dist" / "mermaid.min.js",
+        Path(npm_root) / "mermaid" / "dist" / "mermaid.min.js",
+    ]
+    for candidate in candidates:
+        if candidate.exists():
+            return candidate
+    return None
+
+
+class RenderDaemon:
+    """Long-lived Mermaid renderer that keeps one headless browser warm.
+
+    Listens on a Unix socket (see ``send_message``/``recv_message`` for the
+    wire format) and serves four operations: ``render``, ``validate``,
+    ``stats`` and ``shutdown``. Browser tabs with the Mermaid runtime already loaded are
+    reused between requests, at most ``max_pages`` of them at once. The
+    daemon exits after ``idle_timeout`` seconds without requests.
+    """
+    
+    def __init__(self, socket_path: Path, idle_timeout: float = 900, max_pages: int = 4,
+                 mermaid_js: Optional[Path] = None):
+        self.socket_path = Path(socket_path)
+        self.idle_timeout = idle_timeout
+        self.max_pages = max(1, max_pages)
+        self.mermaid_js = mermaid_js
+        self.browser = None
+        self.idle_pages: Dict[Tuple[float, int, int], List[Any]] = {}
+        self.busy_pages = 0
+        self.started = time.time()
+        self.last_activity = time.monotonic()
+        self.stopping = False
+        self.counters = {"requests": 0, "renders": 0, "failures": 0, "render_seconds": 0.0}
+    
+    def run(self) -> None:
+        """Start the browser and serve until idle or asked to stop."""
+        import asyncio
+        
+        try:
+            from playwright.async_api import async_playwright  # noqa: F401
+        except ImportError:
+            print("❌ The render daemon requires Playwright:")
+            print("   pip install playwright && playwright install chromium")
+            sys.exit(1)
+        
+        if not hasattr(socket, "AF_UNIX"):
+            print("❌ The render daemon requires Unix socket support")
+            sys.exit(1)
+        
+        mermaid_js = self.mermaid_js or find_mermaid_js()
+        if not mermaid_js or not Path(mermaid_js).exists():
+            print("❌ Could not find mermaid.min.js; pass --mermaid-js or install @mermaid-js/mermaid-cli")
+            sys.exit(1)
+        self.mermaid_source = Path(mermaid_js).read_text(encoding='utf-8')
+        
+        if RenderDaemonClient(self.socket_path).stats() is not None:
+            print(f"❌ A render daemon is already listening on {self.socket_path}")
+            sys.exit(1)
+        
+        asyncio.run(self.serve())
+    
+    async def serve(self) -> None:
+        import asyncio
+        from playwright.async_api import async_playwright
+        
+        async with async_playwright() as playwright:
+            self.browser = await playwright.chromium.launch()
+            self.semaphore = asyncio.Semaphore(self.max_pages)
+            
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+            server = await asyncio.start_unix_server(self.handle_connection, path=str(self.socket_path))
+            os.chmod(self.socket_path, 0o600)
+            print(f"🔥 Render daemon listening on {self.socket_path} "
+                  f"(max {self.max_pages} pages, idle timeout {self.idle_timeout:.0f}s)")
+            
+            try:
+                while not self.stopping:
+                    await asyncio.sleep(1)
+                    idle_for = time.monotonic() - self.last_activity
+                    if self.busy_pages == 0 and idle_for > self.idle_timeout:
+                        print(f"💤 Idle for {idle_for:.0f}s, shutting down")
+                        break
+            finally:
+                server.close()
+                await server.wait_closed()
+                if self.socket_path.exists():
+                    self.socket_path.unlink()
+                await self.browser.close()
+        
+        print("👋 Render daemon stopped")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Health and usage figures reported by the ``stats`` operation."""
+        renders = self.counters["renders"]
+        return {
+            "ok": True,
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "browser_version": self.browser.version if self.browser else None,
+            "max_pages": self.max_pages,
+            "busy_pages": self.busy_pages,
+            "idle_pages": sum(len(pages) for pages in self.idle_pages.values()),
+            "idle_timeout": self.idle_timeout,
+            "requests": self.counters["requests"],
+            "renders": renders,
+            "failures": self.counters["failures"],
+            "average_render_ms": round(1000 * self.counters["render_seconds"] / renders, 1) if renders else 0,
+        }
+    
+    async def acquire_page(self, options: Dict[str, Any]) -> Any:
+        """Reuse an idle tab with matching viewport settings or open a new one."""
+        key = (float(options["scale"]), int(options["width"]), int(options["height"]))
+        pages = self.idle_pages.get(key)
+        if pages:
+            return pages.pop()
+        
+        # Keep the total number of open tabs within the page cap
+        idle_total = sum(len(p) for p in self.idle_pages.values())
+        if idle_total + self.busy_pages >= self.max_pages:
+            for other in self.idle_pages.values():
+                if other:
+                    await other.pop().context.close()
+                    break
+        
+        context = await self.browser.new_context(
+            device_scale_factor=key[0], viewport={"width": key[1], "height": key[2]}
+        )
+        page = await context.new_page()
+        await page.set_content(DAEMON_PAGE_HTML)
+        await page.add_script_tag(content=self.mermaid_source)
+        page.daemon_key = key
+        return page
+    
+    async def render(self, code: str, output_format: str, options: Dict[str, Any]) -> bytes:
+        options = dict(DEFAULT_RENDER_OPTIONS, **options)
+        async with self.semaphore:
+            page = await self.acquire_page(options)
+            self.busy_pages += 1
+            try:
+                # SVG output uses plain text labels, see SVG_MERMAID_CONFIG
+                svg = await page.evaluate(DAEMON_RENDER_JS, [code, options["theme"], options["backgroundColor"],
+                                                             output_format != "svg"])
+                if output_format == "svg":
+                    return svg.encode('utf-8')
+                return await page.locator("#container > svg").screenshot()
+            finally:
+                self.busy_pages -= 1
+                self.idle_pages.setdefault(page.daemon_key, []).append(page)
+    
+    async def validate(self, codes: List[str]) -> List[Optional[str]]:
+        async with self.semaphore:
+            page = await self.acquire_page(DEFAULT_RENDER_OPTIONS)
+            self.busy_pages += 1
+            try:
+                return await page.evaluate(DAEMON_VALIDATE_JS, codes)
+            finally:
+                self.busy_pages -= 1
+                self.idle_pages.setdefault(page.daemon_key, []).append(page)
+    
+    async def handle_connection(self, reader, writer) -> None:
+        self.last_activity = time.monotonic()
+        self.counters["requests"] += 1
+        try:
+            header = json.loads(await reader.readline())
+            body = await reader.readexactly(header.get("size", 0))
+            op = header.get("op")
+            
+            payload = b""
+            if op == "stats":
+                response = self.stats()
+            elif op == "shutdown":
+                self.stopping = True
+                response = {"ok": True}
+            elif op == "render":
+                started = time.perf_counter()
+                try:
+                    payload = await self.render(body.decode('utf-8'), header.get("format", "png"),
+                                                header.get("options", {}))
+                    self.counters["renders"] += 1
+                    response = {"ok": True}
+                except Exception as e:
+                    self.counters["failures"] += 1
+                    response = {"ok": False, "error": str(e)}
+                self.counters["render_seconds"] += time.perf_counter() - started
+            elif op == "validate":
+                payload = json.dumps(await self.validate(json.loads(body))).encode('utf-8')
+                response = {"ok": True}
+            else:
+                response = {"ok": False, "error": f"Unknown operation: {op}"}
+            
+            response["size"] = len(payload)
+            writer.write(json.dumps(response).encode('utf-8') + b"\n" + payload)
+            await writer.drain()
+        except (ValueError, ConnectionError) as e:
+            print(f"⚠️  Dropped malformed request: {e}")
+        finally:
+            self.last_activity = time.monotonic()
+            writer.close()
+
+
+def daemon_main(argv: List[str]) -> None:
+    """Entry point of the ``daemon`` subcommand."""
+    parser = argparse.ArgumentParser(
+        prog="doc_generator.py daemon",
+        description="Run a warm Mermaid render daemon that builds reuse across runs"
+    )
+    parser.add_argument("--socket", default=str(default_daemon_socket()),
+                        help="Unix socket to listen on (default: %(default)s)")
+    parser.add_argument("--idle-timeout", type=float, default=900,
+                        help="Exit after this many idle seconds (default: %(default)s)")
+    parser.add_argument("--max-pages", type=int, default=4,
+                        help="Maximum concurrent browser pages (default: %(default)s)")
+    parser.add_argument("--mermaid-js", help="Path to mermaid.min.js (default: from the global Mermaid CLI)")
+    parser.add_argument("--stats", action="store_true", help="Print stats of the running daemon and exit")
+    parser.add_argument("--stop", action="store_true", help="Ask the running daemon to shut down")
+    args = parser.parse_args(argv)
+    
+    client = RenderDaemonClient(Path(args.socket), timeout=10)
+    if args.stats or args.stop:
+        stats = client.stats()
+        if stats is None:
+            print(f"❌ No render daemon listening on {args.socket}")
+            sys.exit(1)
+        if args.stop:
+            client.request({"op": "shutdown"})
+            print("👋 Render daemon is shutting down")
+        else:
+            print(json.dumps(stats, indent=2))
+        return
+    
+    RenderDaemon(
+        socket_path=Path(args.socket),
+        idle_timeout=args.idle_timeout,
+        max_pages=args.max_pages,
+        mermaid_js=Path(args.mermaid_js) if args.mermaid_js else None
+    ).run()
+
+
+def cache_main(argv: List[str]) -> None:
+    """Entry point of the ``cache`` subcommand."""
+    parser = argparse.ArgumentParser(
+        prog="doc_generator.py cache",
+        description="Save the diagram cache to, or restore it from, one portable archive (e.g. a CI artifact)"
+    )
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--cache-dir", help=f"Diagram cache directory (default: {default_cache_dir()})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    export_parser = commands.add_parser("export", parents=[common],
+                                        help="Write cached diagrams and their manifest to an archive")
+    export_parser.add_argument("bundle", help="Archive to write, e.g. diagrams.tar.gz")
+    export_parser.add_argument("--recent-builds", type=int,
+                               help="Only export diagrams used by this many most recent builds")
+    
+    import_parser = commands.add_parser("import", parents=[common],
+                                        help="Add the diagrams of an archive missing from the cache")
+    import_parser.add_argument("bundle", help="Archive written by cache export")
+    
+    serve_parser = commands.add_parser("serve", help="Run a remote diagram cache server for a team or CI")
+    serve_parser.add_argument("--root", default=str(default_cache_dir().parent / "remote"),
+                              help="Directory the server stores diagrams in (default: %(default)s)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: %(default)s)")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: %(default)s)")
+    serve_parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+    
+    if args.command == "serve":
+        server = RemoteCacheServer(Path(args.root), args.host, args.port, verbose=args.verbose)
+        print(f"🌐 Remote diagram cache serving {args.root} at {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n👋 Remote diagram cache stopped")
+        finally:
+            server.server_close()
+        return
+    
+    cache_dir = Path(args.cache_dir) if args.cache_dir else default_cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache = DiagramCache(cache_dir)
+    bundle = Path(args.bundle)
+    
+    # Keep eviction by concurrent builds away while entries are read or added
+    usage_lock = cache.usage_lock()
+    usage_lock.acquire(shared=True)
+    try:
+        if args.command == "export":
+            count, size = cache.export_bundle(bundle, args.recent_builds)
+            print(f"📦 Exported {count} cached diagram(s) to {bundle} ({format_size(size)})")
+            return
+        
+        try:
+            counts = cache.import_bundle(bundle)
+        except (OSError, ValueError, KeyError, tarfile.TarError) as e:
+            print(f"❌ Could not import {bundle}: {e}")
+            sys.exit(1)
+    finally:
+        usage_lock.release()
+    
+    print(f"📥 Imported {counts['imported']} diagram(s) from {bundle}; "
+          f"{counts['skipped']} already cached, {counts['corrupt']} failed verification")
+    if counts["corrupt"]:
+        sys.exit(1)
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        daemon_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "cache":
+        cache_main(sys.argv[2:])
+        return
+    
+    # "warm-cache" (or "render") takes the build options but only fills the diagram cache
+    warm_cache = len(sys.argv) > 1 and sys.argv[1] in ("warm-cache", "render")
+    argv = sys.argv[2:] if warm_cache else sys.argv[1:]
+    
     parser = argparse.ArgumentParser(
-        description="Generate Word documentation from Markdown files",
+        prog=f"{Path(sys.argv[0]).name} {sys.argv[1]}" if warm_cache else None,
+        description="Render every diagram into the shared cache without building a document" if warm_cache
+        else "Generate Word documentation from Markdown files",
         formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="""
+        epilog=None if warm_cache else """
 Examples:
   %(prog)s docs/                              # Generate from docs/ folder
   %(prog)s docs/ -o output/                   # Custom output directory  
   %(prog)s docs/ -f "Final Report.docx"       # Custom output filename
   %(prog)s docs/ -t template.docx             # Use Word template
   %(prog)s docs/ -o build/ -f report.docx -t styles.docx  # Full customization
+  %(prog)s docs/ -j 8                         # Render 8 diagrams at a time
+  %(prog)s docs/ --batch                      # Render all new diagrams in one mmdc process
+  %(prog)s daemon &                           # Start a warm render daemon used by later builds
+  %(prog)s warm-cache docs/                   # Only render diagrams into the cache (e.g. an early CI job)
+  %(prog)s cache export diagrams.tar.gz       # Save the diagram cache as one CI artifact
+  %(prog)s cache import diagrams.tar.gz       # Restore it without overwriting existing entries
         """
     )
     
@@ -393,16 +4243,219 @@ Examples:
         help="Word template file (.docx) for styling"
     )
     
-    args = parser.parse_args()
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        help=f"Maximum number of diagrams to render in parallel; fewer run while memory is short "
+             f"or the host is busy (default: one per CPU, {DEFAULT_JOBS} here; {MODEST_JOBS} with "
+             f"--fixed-jobs or where free memory cannot be read)"
+    )
+    
+    parser.add_argument(
+        "--fixed-jobs",
+        action="store_true",
+        help="Always render --jobs diagrams in parallel, regardless of host memory and load"
+    )
+    
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Render all uncached diagrams with a single Mermaid CLI process"
+    )
+    
+    parser.add_argument(
+        "--daemon-socket",
+        help=f"Socket of the render daemon (default: {default_daemon_socket()})"
+    )
+    
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Ignore a running render daemon when picking the renderer automatically"
+    )
+    
+    parser.add_argument(
+        "--resync-cache",
+        action="store_true",
+        help="Rebuild the diagram cache index from the files in the images directory"
+    )
+    
+    parser.add_argument(
+        "--cache-dir",
+        help=f"Shared diagram cache directory (default: {default_cache_dir()}); "
+             "pass the output images directory to keep a per-build cache"
+    )
+    
+    parser.add_argument(
+        "--cache-max-size",
+        type=parse_size,
+        default=DEFAULT_CACHE_MAX_BYTES,
+        help="Evict least-recently-used diagrams beyond this cache size, e.g. 500M or 2G (default: 1G)"
+    )
+    
+    parser.add_argument(
+        "--cache-max-age",
+        type=float,
+        default=DEFAULT_CACHE_MAX_AGE / (24 * 3600),
+        help="Evict diagrams not used for this many days; 0 disables (default: %(default)g)"
+    )
+    
+    parser.add_argument(
+        "--cache-keep-builds",
+        type=int,
+        default=DEFAULT_CACHE_KEEP_BUILDS,
+        help="Never evict diagrams used by any of the last N builds (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--diagram-format",
+        choices=DIAGRAM_FORMATS,
+        default="png",
+        help="Embed diagrams as PNG, or as SVG with a PNG fallback ('both' keeps a full-size PNG) (default: png)"
+    )
+    
+    parser.add_argument(
+        "--optimize-png",
+        action="store_true",
+        help="Losslessly optimize rendered PNGs (oxipng/optipng if installed, else built in); done once per cached diagram"
+    )
+    
+    parser.add_argument(
+        "--diagram-dpi",
+        type=int,
+        default=DEFAULT_DIAGRAM_DPI,
+        help="Print resolution diagrams are rendered at with --fit-page (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--fit-page",
+        action="store_true",
+        help="Lay diagrams out for the template's usable page width at --diagram-dpi instead of a "
+             "fixed 1200x800 viewport at 2x (changes every diagram's cache key)"
+    )
+    
+    parser.add_argument(
+        "--render-timeout",
+        type=float,
+        default=DEFAULT_RENDER_TIMEOUT,
+        metavar="SECONDS",
+        help="Kill a diagram's renderer and all its child processes after this long; 0 disables "
+             "(default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--render-retries",
+        type=int,
+        default=DEFAULT_RENDER_RETRIES,
+        help="Retries, with exponential backoff, for renders that timed out or crashed (default: %(default)s)"
+    )
+    
+    parser.add_argument(
+        "--max-failures",
+        type=int,
+        help="Abort the build once more than this many diagrams have failed (default: never)"
+    )
+    
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Render diagrams again that failed in an earlier build with the same source and options"
+    )
+    
+    parser.add_argument(
+        "--no-validate",
+        action="store_true",
+        help="Skip the syntax check of all diagrams that runs before rendering"
+    )
+    
+    parser.add_argument(
+        "--renderer",
+        choices=RENDERERS,
+        default=os.environ.get("DOC_GENERATOR_RENDERER", "auto"),
+        help="Diagram rendering backend: a running render daemon's browser pool, a Kroki server, "
+             "the Mermaid CLI, or the fastest one available (default: $DOC_GENERATOR_RENDERER or auto)"
+    )
+    
+    parser.add_argument(
+        "--kroki-url",
+        default=os.environ.get("KROKI_URL"),
+        help=f"Base URL of a Kroki server; --renderer auto only tries Kroki when this or $KROKI_URL is set "
+             f"(default for --renderer kroki: {DEFAULT_KROKI_URL})"
+    )
+    
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help=f"Leave out Markdown files and directories matching this glob (repeatable; "
+             f"patterns are also read from {DOCIGNORE_FILE} in the root directory)"
+    )
+    
+    parser.add_argument(
+        "--git",
+        action="store_true",
+        help="List Markdown files with git ls-files (honours .gitignore) instead of searching the tree"
+    )
+    
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Build the document even if no input changed since the last build"
+    )
+    
+    parser.add_argument(
+        "--remote-cache",
+        default=os.environ.get("DOC_GENERATOR_REMOTE_CACHE"),
+        metavar="URL",
+        help="HTTP diagram cache shared between machines, e.g. one run with 'cache serve' "
+             "(default: $DOC_GENERATOR_REMOTE_CACHE)"
+    )
+    
+    parser.add_argument(
+        "--remote-cache-read-only",
+        action="store_true",
+        help="Fetch diagrams from the remote cache but never upload new renders"
+    )
+    
+    args = parser.parse_args(argv)
     
     try:
         generator = DocumentationGenerator(
             root_dir=args.root_dir,
             output_dir=args.output,
             output_filename=args.filename,
-            template_doc=args.template
+            template_doc=args.template,
+            jobs=args.jobs,
+            adaptive_jobs=not args.fixed_jobs,
+            rebuild=args.rebuild,
+            exclude=args.exclude,
+            use_git=args.git,
+            batch=args.batch,
+            daemon_socket=args.daemon_socket,
+            use_daemon=not args.no_daemon,
+            resync_cache=args.resync_cache,
+            cache_dir=args.cache_dir,
+            cache_max_bytes=args.cache_max_size,
+            cache_max_age=args.cache_max_age * 24 * 3600 if args.cache_max_age else None,
+            cache_keep_builds=args.cache_keep_builds,
+            diagram_format=args.diagram_format,
+            optimize_png=args.optimize_png,
+            fit_page=args.fit_page,
+            diagram_dpi=args.diagram_dpi,
+            render_timeout=args.render_timeout,
+            render_retries=args.render_retries,
+            max_failures=args.max_failures,
+            retry_failed=args.retry_failed,
+            validate=not args.no_validate,
+            renderer=args.renderer,
+            kroki_url=args.kroki_url,
+            remote_cache=args.remote_cache,
+            remote_cache_read_only=args.remote_cache_read_only
         )
-        generator.generate()
+        if warm_cache:
+            generator.warm_cache()
+        else:
+            generator.generate()
         
     except KeyboardInterrupt:
         print("\n❌ Generation cancelled by user")
@@ -482,8 +4535,8 @@ if __name__ == "__main__":
    ├── combined-original.md    # Combined markdown with original mermaid codeblocks
    ├── combined.md             # Combined markdown with image references (for Word conversion)
    └── images/                 # Generated diagram images
-       ├── diagram-a1b2c3d4.png
-       └── diagram-e5f6g7h8.png
+       ├── diagram-3f9a…c41e.png   # SHA-256 cache key
+       └── diagram-7b20…9ad5.png
 
 🎯 FEATURES:
 ✅ Automatic file discovery and natural sorting
@@ -0,0 +1,89 @@
+"""Tests for exporting and importing diagram cache bundles."""
+
+import hashlib
+import io
+import json
+import sys
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from doc_generator import CACHE_BUNDLE_VERSION, DiagramCache
+
+KEY = hashlib.sha256(b"graph TD").hexdigest()
+IMAGE = b"\x89PNG\r\n\x1a\nnot really a diagram"
+
+
+def write_bundle(path, entries, members):
+    """A bundle with the given manifest entries and {name: data} diagram files."""
+    manifest = json.dumps({"version": CACHE_BUNDLE_VERSION, "created": 0, "entries": entries}).encode()
+    with tarfile.open(path, "w:gz") as archive:
+        for name, data in [("manifest.json", manifest)] + [(f"diagrams/{name}", data) for name, data in members.items()]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+
+def bundle_entry(key=KEY, files=None):
+    name = f"diagram-{key}.png"
+    return {
+        "key": key, "filename": name, "options": "{}", "size": len(IMAGE), "render_seconds": 0.5,
+        "created": 1.0, "last_used": 1.0, "last_build": 1, "optimized": 0, "display_width": 0.0,
+        "files": files if files is not None else {name: hashlib.sha256(IMAGE).hexdigest()},
+    }
+
+
+class CacheBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary = tempfile.TemporaryDirectory()
+        self.root = Path(self.temporary.name)
+        (self.root / "cache").mkdir()
+        self.cache = DiagramCache(self.root / "cache")
+        self.bundle = self.root / "bundle.tar.gz"
+
+    def tearDown(self):
+        self.cache.db.close()
+        self.temporary.cleanup()
+
+    def test_round_trip(self):
+        (self.root / "source").mkdir()
+        source = DiagramCache(self.root / "source")
+        name = f"diagram-{KEY}.png"
+        (source.directory / name).write_bytes(IMAGE)
+        source.record(KEY, name, {"theme": "default"}, len(IMAGE), 0.5)
+        self.assertEqual(source.export_bundle(self.bundle)[0], 1)
+        source.db.close()
+
+        self.assertEqual(self.cache.import_bundle(self.bundle), {"imported": 1, "skipped": 0, "corrupt": 0})
+        self.assertEqual((self.cache.directory / name).read_bytes(), IMAGE)
+        self.assertIn(KEY, self.cache)
+        self.assertEqual(self.cache.import_bundle(self.bundle), {"imported": 0, "skipped": 1, "corrupt": 0})
+
+    def test_checksum_mismatch_is_not_imported(self):
+        write_bundle(self.bundle, [bundle_entry()], {f"diagram-{KEY}.png": IMAGE + b"tampered"})
+        self.assertEqual(self.cache.import_bundle(self.bundle), {"imported": 0, "skipped": 0, "corrupt": 1})
+        self.assertNotIn(KEY, self.cache)
+        self.assertEqual(list(self.cache.directory.glob("diagram-*")), [])
+
+    def test_tampered_manifest_key_is_rejected(self):
+        entry = bundle_entry(key="../../escaped", files={f"diagram-{KEY}.png": hashlib.sha256(IMAGE).hexdigest()})
+        write_bundle(self.bundle, [entry], {f"diagram-{KEY}.png": IMAGE})
+        self.assertEqual(self.cache.import_bundle(self.bundle), {"imported": 0, "skipped": 0, "corrupt": 1})
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(list(self.cache.directory.glob("diagram-*")), [])
+        self.assertEqual(list(self.root.rglob("escaped*")), [])
+
+    def test_files_of_another_key_are_rejected(self):
+        other = hashlib.sha256(b"graph LR").hexdigest()
+        entry = bundle_entry(files={f"diagram-{other}.png": hashlib.sha256(IMAGE).hexdigest()})
+        write_bundle(self.bundle, [entry], {f"diagram-{other}.png": IMAGE})
+        self.assertEqual(self.cache.import_bundle(self.bundle), {"imported": 0, "skipped": 0, "corrupt": 1})
+        self.assertEqual(list(self.cache.directory.glob("diagram-*")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
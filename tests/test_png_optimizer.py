@@ -0,0 +1,161 @@
+"""Tests for the pure-Python PNG optimizer: optimized images must decode to the same pixels."""
+
+import random
+import sys
+import unittest
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from doc_generator import optimize_png_data, read_png_chunks, unfilter_png_rows, write_png_chunks
+
+NONE, SUB, UP, AVERAGE, PAETH = range(5)
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    return a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+
+
+def predictor(filter_type, a, b, c):
+    return (0, a, b, (a + b) >> 1, paeth(a, b, c))[filter_type]
+
+
+def filter_rows(rows, bpp, filters):
+    """Filtered scanlines of ``rows``, row y using filter ``filters[y % len(filters)]``."""
+    raw = bytearray()
+    previous = bytes(len(rows[0]))
+    for y, row in enumerate(rows):
+        filter_type = filters[y % len(filters)]
+        raw.append(filter_type)
+        for i, value in enumerate(row):
+            a = row[i - bpp] if i >= bpp else 0
+            c = previous[i - bpp] if i >= bpp else 0
+            raw.append((value - predictor(filter_type, a, previous[i], c)) & 0xFF)
+        previous = row
+    return bytes(raw)
+
+
+def unfilter_rows(raw, width, height, bpp):
+    """Byte-by-byte reference decoder, independent of ``unfilter_png_rows``."""
+    stride = width * bpp
+    rows = []
+    previous = bytes(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        filter_type, row = raw[start], bytearray(raw[start + 1:start + 1 + stride])
+        for i in range(stride):
+            a = row[i - bpp] if i >= bpp else 0
+            c = previous[i - bpp] if i >= bpp else 0
+            row[i] = (row[i] + predictor(filter_type, a, previous[i], c)) & 0xFF
+        rows.append(bytes(row))
+        previous = rows[-1]
+    return rows
+
+
+def make_png(rows, width, bpp, filters, key=None):
+    """8-bit RGB (bpp 3) or RGBA (bpp 4) PNG, with ``key`` as the RGB tRNS colour key."""
+    header = width.to_bytes(4, "big") + len(rows).to_bytes(4, "big") + bytes([8, 2 if bpp == 3 else 6, 0, 0, 0])
+    chunks = [(b"IHDR", header)]
+    if key is not None:
+        chunks.append((b"tRNS", b"".join(bytes([0, value]) for value in key)))
+    chunks += [(b"tEXt", b"Software\x00test"),
+               (b"IDAT", zlib.compress(filter_rows(rows, bpp, filters))), (b"IEND", b"")]
+    return write_png_chunks(chunks)
+
+
+def decode_rgba(data):
+    """(colour type, pixels as RGBA tuples) of an 8-bit PNG of colour type 2, 3 or 6."""
+    chunks = dict(read_png_chunks(data))
+    header = chunks[b"IHDR"]
+    width, height = int.from_bytes(header[0:4], "big"), int.from_bytes(header[4:8], "big")
+    color_type = header[9]
+    idat = b"".join(payload for chunk_type, payload in read_png_chunks(data) if chunk_type == b"IDAT")
+    bpp = {2: 3, 3: 1, 6: 4}[color_type]
+    rows = unfilter_rows(zlib.decompress(idat), width, height, bpp)
+    transparency = chunks.get(b"tRNS")
+    pixels = []
+    for row in rows:
+        for x in range(width):
+            sample = row[x * bpp:(x + 1) * bpp]
+            if color_type == 3:
+                index = sample[0]
+                rgb = tuple(chunks[b"PLTE"][3 * index:3 * index + 3])
+                alpha = transparency[index] if transparency and index < len(transparency) else 255
+                pixels.append(rgb + (alpha,))
+            elif color_type == 2:
+                key = tuple(transparency[1::2]) if transparency else None
+                pixels.append(tuple(sample) + (0 if tuple(sample) == key else 255,))
+            else:
+                pixels.append(tuple(sample))
+    return color_type, pixels
+
+
+def diagram_rows(width, height, bpp, colors=40, seed=1):
+    """Blocky rows with few colours, like a diagram, drawn from random full-range byte values."""
+    rng = random.Random(seed)
+    palette = [bytes(rng.randrange(256) for _ in range(bpp)) for _ in range(colors)]
+    return [b"".join(palette[(x // 7 + y // 5 + (x * y) % 3) % colors] for x in range(width))
+            for y in range(height)]
+
+
+class UnfilterRowsTest(unittest.TestCase):
+
+    def test_every_filter_matches_the_reference_decoder(self):
+        for bpp in (3, 4):
+            for filters in ([NONE], [SUB], [UP], [AVERAGE], [PAETH], [NONE, SUB, UP, AVERAGE, PAETH]):
+                with self.subTest(bpp=bpp, filters=filters):
+                    rows = diagram_rows(97, 12, bpp)
+                    raw = filter_rows(rows, bpp, filters)
+                    self.assertEqual(unfilter_png_rows(raw, 97, 12, bpp), rows)
+                    self.assertEqual(unfilter_rows(raw, 97, 12, bpp), rows)
+
+    def test_sub_and_up_carry_in_every_byte(self):
+        # Bytes of 0xFF and 0x80 make every lane overflow in the SWAR additions
+        for bpp in (3, 4):
+            rows = [bytes([0xFF, 0x80, 0x01, 0x7F][:bpp]) * 50, bytes([0x80, 0xFF, 0x7F, 0x01][:bpp]) * 50]
+            for filters in ([SUB], [UP], [SUB, UP]):
+                with self.subTest(bpp=bpp, filters=filters):
+                    raw = filter_rows(rows, bpp, filters)
+                    self.assertEqual(unfilter_png_rows(raw, 50, 2, bpp), rows)
+
+
+class OptimizePngDataTest(unittest.TestCase):
+
+    def assert_same_pixels(self, data, palette=True):
+        optimized = optimize_png_data(data)
+        self.assertLessEqual(len(optimized), len(data))
+        color_type, pixels = decode_rgba(optimized)
+        self.assertEqual(pixels, decode_rgba(data)[1])
+        if palette:
+            self.assertEqual(color_type, 3)
+        return optimized
+
+    def test_rgba_with_each_filter(self):
+        for filters in ([NONE], [SUB], [UP], [AVERAGE], [PAETH], [NONE, SUB, UP, AVERAGE, PAETH]):
+            with self.subTest(filters=filters):
+                self.assert_same_pixels(make_png(diagram_rows(120, 40, 4), 120, 4, filters))
+
+    def test_rgb_with_each_filter(self):
+        for filters in ([SUB], [UP], [AVERAGE], [PAETH], [NONE, SUB, UP, AVERAGE, PAETH]):
+            with self.subTest(filters=filters):
+                self.assert_same_pixels(make_png(diagram_rows(120, 40, 3), 120, 3, filters))
+
+    def test_rgb_colour_key_becomes_transparent_palette_entry(self):
+        rows = diagram_rows(120, 40, 3)
+        key = tuple(rows[0][:3])
+        data = make_png(rows, 120, 3, [SUB, UP, PAETH], key=key)
+        self.assertIn((*key, 0), decode_rgba(data)[1])
+        optimized = self.assert_same_pixels(data)
+        self.assertIn(b"tRNS", dict(read_png_chunks(optimized)))
+
+    def test_too_many_colours_keep_truecolor(self):
+        rng = random.Random(2)
+        rows = [bytes(rng.randrange(256) for _ in range(64 * 3)) for _ in range(16)]
+        self.assert_same_pixels(make_png(rows, 64, 3, [PAETH]), palette=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
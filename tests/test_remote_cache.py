@@ -0,0 +1,148 @@
+"""Tests for the HTTP remote diagram cache client and its reference server."""
+
+import contextlib
+import hashlib
+import http.client
+import http.server
+import io
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from doc_generator import DocumentationGenerator, RemoteCacheServer, RemoteDiagramCache
+
+KEY = hashlib.sha256(b"graph TD").hexdigest()
+NAME = f"diagram-{KEY}.png"
+IMAGE = b"\x89PNG\r\n\x1a\nnot really a diagram"
+
+
+class FailingHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every request with 503, like an overloaded cache server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def fail(self) -> None:
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = do_HEAD = do_PUT = fail
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(server):
+    """Run ``server`` in a background thread; returns a function that stops it."""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    return stop
+
+
+def unused_port():
+    """A local port nothing listens on."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class RemoteCacheServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary = tempfile.TemporaryDirectory()
+        self.root = Path(self.temporary.name)
+        self.server = RemoteCacheServer(self.root / "remote", port=0)
+        self.addCleanup(serve(self.server))
+        self.remote = RemoteDiagramCache(self.server.url, timeout=5)
+
+    def tearDown(self):
+        self.temporary.cleanup()
+
+    def test_round_trip(self):
+        self.assertFalse(self.remote.exists(NAME))
+        self.assertIsNone(self.remote.fetch(NAME))
+
+        self.assertTrue(self.remote.store(NAME, IMAGE))
+        self.assertTrue(self.remote.exists(NAME))
+        self.assertEqual(self.remote.fetch(NAME), IMAGE)
+        self.assertEqual((self.server.root / NAME).read_bytes(), IMAGE)
+        # Content-addressed: a second upload of the same name is skipped
+        self.assertFalse(self.remote.store(NAME, IMAGE))
+        self.assertFalse(self.remote.disabled)
+
+    def test_read_only_client_does_not_upload(self):
+        remote = RemoteDiagramCache(self.server.url, read_only=True, timeout=5)
+        self.assertFalse(remote.store(NAME, IMAGE))
+        self.assertFalse((self.server.root / NAME).exists())
+
+    def test_checksum_mismatch_is_rejected(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=5)
+        self.addCleanup(connection.close)
+        connection.request("PUT", f"/diagram/{NAME}", body=IMAGE,
+                           headers={"X-Checksum-Sha256": hashlib.sha256(b"something else").hexdigest()})
+        response = connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 400)
+        self.assertFalse((self.server.root / NAME).exists())
+        self.assertFalse(self.remote.exists(NAME))
+
+    def test_names_outside_the_cache_are_refused(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=5)
+        self.addCleanup(connection.close)
+        connection.request("PUT", "/diagram/..%2Fescaped.png", body=IMAGE)
+        response = connection.getresponse()
+        response.read()
+        self.assertEqual(response.status, 404)
+        self.assertEqual(list(self.root.rglob("*escaped*")), [])
+
+
+class UnavailableRemoteTest(unittest.TestCase):
+    """A remote that cannot be reached or fails is disabled and the build goes on without it."""
+
+    def setUp(self):
+        self.temporary = tempfile.TemporaryDirectory()
+        self.root = Path(self.temporary.name)
+        (self.root / "docs").mkdir()
+
+    def tearDown(self):
+        self.temporary.cleanup()
+
+    def generator(self, url):
+        generator = DocumentationGenerator(str(self.root / "docs"), str(self.root / "build"),
+                                           cache_dir=str(self.root / "cache"), remote_cache=url)
+        self.addCleanup(generator.cache.db.close)
+        return generator
+
+    def check_build_carries_on(self, url):
+        generator = self.generator(url)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(generator.fetch_remote_diagrams({KEY: (1, "graph TD", "mermaid")}), set())
+            (generator.cache_dir / NAME).write_bytes(IMAGE)
+            generator.upload_remote_diagrams({KEY})
+        self.assertTrue(generator.remote.disabled)
+        self.assertIn("continuing without it", output.getvalue())
+        # Disabled for the rest of the build: no further requests are made
+        self.assertIsNone(generator.remote.request("GET", NAME))
+        self.assertEqual(generator.remote.counters["uploads"], 0)
+
+    def test_unreachable_remote(self):
+        self.check_build_carries_on(f"http://127.0.0.1:{unused_port()}")
+
+    def test_server_errors(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FailingHandler)
+        self.addCleanup(serve(server))
+        self.check_build_carries_on(f"http://127.0.0.1:{server.server_address[1]}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Tests for the CommonMark fence tokenizer that finds diagram blocks."""
+
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from doc_generator import tokenize_fences
+
+
+def diagrams(text):
+    """The diagram tokens of ``text`` as (start, end, code, language, code_line, indent)."""
+    tokens = tokenize_fences(text.splitlines(keepends=True))
+    return [(*token[1], token[2], token[3]) for token in tokens if token[0] == "diagram"]
+
+
+class TokenizeFencesTest(unittest.TestCase):
+
+    def test_backtick_fence(self):
+        text = "# Title\n```mermaid\ngraph TD\n  A --> B\n```\nafter\n"
+        self.assertEqual(diagrams(text), [(1, 5, "graph TD\n  A --> B", "mermaid", 2, "")])
+
+    def test_text_lines_keep_their_numbers(self):
+        text = "one\n```mermaid\ngraph TD\n```\ntwo\n"
+        tokens = list(tokenize_fences(text.splitlines(keepends=True)))
+        self.assertEqual([token for token in tokens if token[0] == "text"],
+                         [("text", 0, "one\n"), ("text", 4, "two\n")])
+
+    def test_tilde_fence(self):
+        text = "~~~mermaid\ngraph TD\n~~~\n"
+        self.assertEqual(diagrams(text), [(0, 3, "graph TD", "mermaid", 1, "")])
+
+    def test_tilde_fence_is_not_closed_by_backticks(self):
+        text = "~~~mermaid\ngraph TD\n```\n  A --> B\n~~~\n"
+        self.assertEqual(diagrams(text)[0][2], "graph TD\n```\n  A --> B")
+
+    def test_longer_fence_needs_a_closing_run_at_least_as_long(self):
+        text = "`````mermaid\ngraph TD\n```\n````\n``````\n"
+        self.assertEqual(diagrams(text), [(0, 5, "graph TD\n```\n````", "mermaid", 1, "")])
+
+    def test_diagram_inside_another_fence_is_text(self):
+        text = "````markdown\n```mermaid\ngraph TD\n```\n````\n```dot\ndigraph { a -> b }\n```\n"
+        self.assertEqual(diagrams(text), [(5, 8, "digraph { a -> b }", "graphviz", 6, "")])
+
+    def test_info_string_with_backtick_is_not_a_fence(self):
+        self.assertEqual(diagrams("```mermaid `x`\ngraph TD\n```\n"), [])
+
+    def test_crlf_line_endings(self):
+        text = "```mermaid\r\ngraph TD\r\n  A --> B\r\n```\r\n"
+        self.assertEqual(diagrams(text), [(0, 4, "graph TD\n  A --> B", "mermaid", 1, "")])
+
+    def test_fence_indented_up_to_three_spaces(self):
+        text = "   ```mermaid\n   graph TD\n     A --> B\n   ```\n"
+        self.assertEqual(diagrams(text), [(0, 4, "graph TD\n  A --> B", "mermaid", 1, "   ")])
+
+    def test_four_space_fence_at_top_level_is_indented_code(self):
+        text = "Paragraph\n\n    ```mermaid\n    graph TD\n    ```\n"
+        self.assertEqual(diagrams(text), [])
+
+    def test_four_space_fence_inside_list_item(self):
+        text = "1. Step\n\n    ```mermaid\n    graph TD\n    ```\n"
+        self.assertEqual(diagrams(text), [(2, 5, "graph TD", "mermaid", 3, "    ")])
+
+    def test_fence_on_list_marker_line(self):
+        text = "- Step\n- ```mermaid\n  graph TD\n    A --> B\n  ```\n"
+        self.assertEqual(diagrams(text), [(1, 5, "graph TD\n  A --> B", "mermaid", 2, "- ")])
+
+    def test_fence_on_ordered_list_marker_line(self):
+        text = "1. ```mermaid\n   graph TD\n   ```\n2. Next\n"
+        self.assertEqual(diagrams(text), [(0, 3, "graph TD", "mermaid", 1, "1. ")])
+
+    def test_fence_on_list_marker_line_in_block_quote(self):
+        text = "> - ```mermaid\n>   graph TD\n>   ```\n"
+        self.assertEqual(diagrams(text), [(0, 3, "graph TD", "mermaid", 1, "> - ")])
+
+    def test_nested_list_item(self):
+        text = "- outer\n  - inner\n\n      ```mermaid\n      graph TD\n      ```\n"
+        self.assertEqual(diagrams(text), [(3, 6, "graph TD", "mermaid", 4, "      ")])
+
+    def test_list_ends_at_unindented_paragraph(self):
+        text = "- item\n\nParagraph\n\n    ```mermaid\n    graph TD\n    ```\n"
+        self.assertEqual(diagrams(text), [])
+
+    def test_block_quote_fence(self):
+        text = "> Note\n> ```mermaid\n> graph TD\n>   A --> B\n> ```\n"
+        self.assertEqual(diagrams(text), [(1, 5, "graph TD\n  A --> B", "mermaid", 2, "> ")])
+
+    def test_fence_ends_with_its_block_quote(self):
+        text = "> ```mermaid\n> graph TD\nplain\n```\n"
+        self.assertEqual(diagrams(text), [])
+
+    def test_unclosed_fence_is_text(self):
+        text = "```mermaid\ngraph TD\n"
+        tokens = list(tokenize_fences(text.splitlines(keepends=True)))
+        self.assertEqual(tokens, [("text", 0, "```mermaid\n"), ("text", 1, "graph TD\n")])
+
+    def test_empty_diagram_is_text(self):
+        self.assertEqual(diagrams("```mermaid\n\n```\n"), [])
+
+    def test_first_code_line_skips_leading_blank_lines(self):
+        self.assertEqual(diagrams("```plantuml\n\n\nA -> B\n```\n"), [(0, 5, "A -> B", "plantuml", 3, "")])
+
+
+if __name__ == "__main__":
+    unittest.main()